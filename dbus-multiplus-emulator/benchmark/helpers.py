@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# Helpers shared by the benchmarks. The benchmarks need dbus-python and PyGObject and have to be run on a
+# D-Bus session bus, which does not disturb a running system, e.g.:
+#   dbus-run-session -- python benchmark/publish_plan.py
+
+import importlib.util
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+emulator_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(1, os.path.join(emulator_dir, "ext", "velib_python"))
+
+
+def load_emulator():
+    # the script name contains dashes, so it can not be imported by name
+    spec = importlib.util.spec_from_file_location(
+        "dbus_multiplus_emulator",
+        os.path.join(emulator_dir, "dbus-multiplus-emulator.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # never touch the energy files or the config of a real installation, main() resets the
+    # globals to the config defaults
+    tmp_dir = tempfile.mkdtemp(prefix="dbus-multiplus-emulator-benchmark-")
+    files = {
+        "data_watt_hours_working_file": os.path.join(tmp_dir, "working.json"),
+        "data_watt_hours_storage_file": os.path.join(tmp_dir, "storage.json"),
+        "data_watt_hours_journal_file": os.path.join(tmp_dir, "storage.journal"),
+    }
+    for name, file in files.items():
+        setattr(module, name, file)
+        module.config_defaults[name] = file
+    module.config_file = os.path.join(tmp_dir, "config.ini")
+    return module
+
+
+def measure(func, iterations):
+    # returns the mean time per call in µs
+    start = perf_counter()
+    for _ in range(iterations):
+        func()
+    return (perf_counter() - start) / iterations * 1000000
+
+
+def report(title, results):
+    print(title)
+    for name, value in results:
+        print("  %-40s %10.1f" % (name, value))
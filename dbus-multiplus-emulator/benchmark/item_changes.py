@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Compares the µs per ItemsChanged signal of DbusMonitor.handler_item_changes with the previous
+# handler, which unwrapped every entry and built its text before checking if the path is monitored.
+# The payload has 200 items like a battery driver sends, of which the emulator monitors 9.
+#   python benchmark/item_changes.py
+
+import sys
+
+import dbus
+
+from helpers import measure, report
+
+from dbusmonitor import DbusMonitor, Service, MonitoredValue
+from ve_utils import unwrap_dbus_value
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+monitored_paths = (
+    "/Dc/0/Current",
+    "/Dc/0/Power",
+    "/Dc/0/Temperature",
+    "/Dc/0/Voltage",
+    "/Soc",
+    "/Info/ChargeMode",
+    "/Info/MaxChargeCurrent",
+    "/Info/MaxChargeVoltage",
+    "/Info/MaxDischargeCurrent",
+)
+
+
+# the handler as it was before the monitored paths were checked first, as reference
+def legacy_handler_item_changes(monitor, items, senderId):
+    if not isinstance(items, dict):
+        return
+
+    try:
+        service = monitor.servicesById[senderId]
+    except KeyError:
+        return
+
+    for path, changes in items.items():
+        try:
+            v = unwrap_dbus_value(changes["Value"])
+        except (KeyError, TypeError):
+            continue
+
+        try:
+            t = changes["Text"]
+        except KeyError:
+            t = str(v)
+        monitor._handler_value_changes(service, path, v, t)
+
+
+def make_payload(offset):
+    # 200 items, the monitored ones and cell voltages, temperatures and alarms that are not monitored
+    items = {}
+    for path in monitored_paths:
+        if path == "/Info/ChargeMode":
+            items[path] = {"Value": dbus.String("Bulk", variant_level=1)}
+        else:
+            items[path] = {"Value": dbus.Double(offset + len(items), variant_level=1)}
+    number = 0
+    while len(items) < 200:
+        items["/Voltages/Cell%d" % number] = {
+            "Value": dbus.Double(3.3 + offset / 1000, variant_level=1),
+            "Text": dbus.String("%.3fV" % (3.3 + offset / 1000)),
+        }
+        items["/Alarms/Cell%d" % number] = {"Value": dbus.Int32(offset, variant_level=1)}
+        number += 1
+    return dbus.Dictionary(items, signature="sa{sv}")
+
+
+def main():
+    # no bus needed, the monitor only gets the scanned service
+    monitor = DbusMonitor.__new__(DbusMonitor)
+    monitor.valueChangedCallback = None
+    monitor.valuesChangedCallback = None
+    monitor.signalsReceived = 0
+    service = Service(":1.42", "com.victronenergy.battery.benchmark", 512)
+    for path in monitored_paths:
+        service.paths[path] = MonitoredValue(None, None, {})
+    monitor.servicesById = {service.id: service}
+    monitor.servicesByName = {service.name: service}
+
+    # alternate between two payloads, so every monitored value changes
+    payloads = (make_payload(0), make_payload(1))
+    state = [0]
+
+    def legacy():
+        state[0] ^= 1
+        legacy_handler_item_changes(monitor, payloads[state[0]], service.id)
+
+    def filtered():
+        state[0] ^= 1
+        monitor.handler_item_changes(payloads[state[0]], service.id)
+
+    legacy_us = measure(legacy, iterations)
+    filtered_us = measure(filtered, iterations)
+
+    report(
+        "µs per ItemsChanged with 200 items, %d monitored, %d iterations" % (len(monitored_paths), iterations),
+        (
+            ("unwrap every item", legacy_us),
+            ("filter before unwrap", filtered_us),
+            ("speedup", legacy_us / filtered_us),
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Compares the memory of the monitored services and values of DbusMonitor with the previous classes,
+# which kept a __dict__ per object and the seen paths in a set per service.
+# Also measures the ns to update a value and set it as seen, like a received change signal does.
+#   python benchmark/monitor_memory.py [services] [paths]
+
+import sys
+import tracemalloc
+
+from helpers import measure, report
+
+from dbusmonitor import Service, MonitoredValue
+
+services_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+paths_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+iterations = 100000
+
+
+# the classes as they were before the slots, as reference
+class LegacyMonitoredValue(object):
+    def __init__(self, value, text, options):
+        self.value = value
+        self.text = text
+        self.options = options
+
+
+class LegacyService(object):
+    def __init__(self, id, serviceName, deviceInstance):
+        self.id = id
+        self.name = serviceName
+        self.paths = {}
+        self._seen = set()
+        self.deviceInstance = deviceInstance
+
+    def set_seen(self, path):
+        self._seen.add(path)
+
+    def seen(self, path):
+        return path in self._seen
+
+
+# the same options dict is shared by all paths, like the dbusTree of a monitor does
+options = {}
+paths = ["/Monitored/Path%d" % number for number in range(paths_count)]
+
+
+def build(service_class, value_class):
+    services = []
+    for number in range(services_count):
+        service = service_class(":1.%d" % number, "com.victronenergy.battery.benchmark_%d" % number, number)
+        for path in paths:
+            service.paths[path] = value_class(float(number), None, options)
+            service.set_seen(path)
+        services.append(service)
+    return services
+
+
+def allocated(service_class, value_class):
+    # returns the bytes allocated by the services and their values and the services, to keep them alive
+    tracemalloc.start()
+    services = build(service_class, value_class)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, services
+
+
+def main():
+    legacy_bytes, legacy_services = allocated(LegacyService, LegacyMonitoredValue)
+    slots_bytes, slots_services = allocated(Service, MonitoredValue)
+
+    def legacy_update():
+        # like DbusMonitor._handler_value_changes before the slots
+        a = legacy_services[-1].paths[paths[-1]]
+        legacy_services[-1].set_seen(paths[-1])
+        a.value = a.value + 1
+
+    def slots_update():
+        # like DbusMonitor._handler_value_changes
+        a = slots_services[-1].paths[paths[-1]]
+        a.seen = True
+        a.value = a.value + 1
+
+    legacy_us = measure(legacy_update, iterations)
+    slots_us = measure(slots_update, iterations)
+
+    values = services_count * paths_count
+    report(
+        "memory of %d services × %d paths" % (services_count, paths_count),
+        (
+            ("dict and seen set, KiB", legacy_bytes / 1024),
+            ("slots and seen flag, KiB", slots_bytes / 1024),
+            ("dict and seen set, bytes per path", legacy_bytes / values),
+            ("slots and seen flag, bytes per path", slots_bytes / values),
+            ("saved, %", (1 - slots_bytes / legacy_bytes) * 100),
+        ),
+    )
+    report(
+        "ns to update a value and set it as seen, %d iterations" % iterations,
+        (
+            ("dict and seen set", legacy_us * 1000),
+            ("slots and seen flag", slots_us * 1000),
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Compares the µs per tick of the precompiled publish plan with the previous per-tick
+# path formatting and path lookups. Only computing and setting the derived values is measured,
+# the ItemsChanged signal and the counters of a tick cost the same in both variants. The inputs
+# either change in every tick or stay the same, then no value has to be wrapped for D-Bus.
+#   dbus-run-session -- python benchmark/publish_plan.py
+
+import random
+import sys
+
+from dbus.mainloop.glib import DBusGMainLoop
+
+from helpers import load_emulator, measure, report
+
+from vedbus import ServiceContext
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+
+def main():
+    DBusGMainLoop(set_as_default=True)
+    emulator_module = load_emulator()
+    phases = emulator_module.phases
+
+    class EmulatorHost(emulator_module.EmulatorHost):
+        # no inputs needed, the values are set by the benchmark
+        def _create_dbus_monitor(self, *args, **kwargs):
+            return None
+
+    host = EmulatorHost(
+        [{"servicename": "com.victronenergy.vebus.benchmark", "deviceinstance": 275, "phases": phases}],
+        emulator_module.get_paths_dbus(),
+    )
+    emulator = host.units[0]
+    for path, value in {
+        "/Dc/0/Current": 10.0,
+        "/Dc/0/Power": 520.0,
+        "/Dc/0/Temperature": 21.0,
+        "/Dc/0/Voltage": 52.0,
+        "/Soc": 80.0,
+        "/Info/ChargeMode": "Bulk",
+        "/Info/MaxChargeCurrent": 100.0,
+        "/Info/MaxChargeVoltage": 55.2,
+        "/Info/MaxDischargeCurrent": 100.0,
+    }.items():
+        host.batteryValues[path].value = value
+
+    def change_inputs():
+        for phase in phases:
+            host.gridValues[f"/Ac/{phase}/Power"].value = random.uniform(-3000, 3000)
+            host.gridValues[f"/Ac/{phase}/Voltage"].value = random.uniform(225, 235)
+
+    # the tick as it was before the publish plan, as reference, the changes are collected but not sent
+    def legacy_update():
+        dbusservice = ServiceContext(emulator._dbusservice)
+        ac_in_power = {phase: host.gridValues[f"/Ac/{phase}/Power"].value for phase in phases}
+        ac_in_voltage = {phase: host.gridValues[f"/Ac/{phase}/Voltage"].value for phase in phases}
+        ac_out_power = {phase: ac_in_power[phase] for phase in phases}
+
+        ac_in = {}
+        for phase in phases:
+            ac_in[phase] = {
+                "current": round(ac_in_power[phase] / ac_in_voltage[phase], 2) if ac_in_voltage[phase] > 0 else 0,
+                "power": ac_in_power[phase],
+                "voltage": ac_in_voltage[phase],
+            }
+
+        ac_out = {}
+        for phase in phases:
+            ac_out[phase] = {
+                "current": round(ac_out_power[phase] / ac_in_voltage[phase], 2) if ac_in_voltage[phase] > 0 else 0,
+                "power": ac_out_power[phase],
+                "voltage": ac_in_voltage[phase],
+            }
+
+        for phase in phases:
+            dbusservice[f"/Ac/ActiveIn/{phase}/I"] = ac_in[phase]["current"]
+            dbusservice[f"/Ac/ActiveIn/{phase}/P"] = ac_in[phase]["power"]
+            dbusservice[f"/Ac/ActiveIn/{phase}/S"] = ac_in[phase]["power"]
+            dbusservice[f"/Ac/ActiveIn/{phase}/V"] = ac_in[phase]["voltage"]
+            dbusservice[f"/Ac/Out/{phase}/I"] = ac_out[phase]["current"]
+            dbusservice[f"/Ac/Out/{phase}/P"] = ac_out[phase]["power"]
+            dbusservice[f"/Ac/Out/{phase}/S"] = ac_out[phase]["power"]
+            dbusservice[f"/Ac/Out/{phase}/V"] = ac_out[phase]["voltage"]
+
+        dbusservice["/Ac/ActiveIn/P"] = sum(ac_in_power.values())
+        dbusservice["/Ac/ActiveIn/S"] = sum(ac_in_power.values())
+        dbusservice["/Ac/Out/P"] = sum(ac_out_power.values())
+        dbusservice["/Ac/Out/S"] = sum(ac_out_power.values())
+
+        for path, key in (
+            ("/BatteryOperationalLimits/MaxChargeCurrent", "/Info/MaxChargeCurrent"),
+            ("/BatteryOperationalLimits/MaxChargeVoltage", "/Info/MaxChargeVoltage"),
+            ("/BatteryOperationalLimits/MaxDischargeCurrent", "/Info/MaxDischargeCurrent"),
+            ("/Dc/0/Current", "/Dc/0/Current"),
+            ("/Dc/0/MaxChargeCurrent", "/Info/MaxChargeCurrent"),
+            ("/Dc/0/Power", "/Dc/0/Power"),
+            ("/Dc/0/Temperature", "/Dc/0/Temperature"),
+            ("/Dc/0/Voltage", "/Dc/0/Voltage"),
+            ("/Soc", "/Soc"),
+        ):
+            dbusservice[path] = host.batteryValues[key].value
+
+        for led in ("Absorption", "Bulk", "Float"):
+            dbusservice[f"/Leds/{led}"] = 1 if host.batteryValues["/Info/ChargeMode"].value.startswith(led) else 0
+
+        for index, direction in enumerate(emulator_module.energy_directions):
+            dbusservice[f"/Energy/{direction}"] = round(emulator._derived.energy.kwh[index], 3)
+
+    def plan_update():
+        emulator._publish_derived({})
+
+    results = []
+    for name, change in (("changing", change_inputs), ("unchanged", lambda: None)):
+        # the inputs are changed in both variants, the time needed for that is subtracted
+        random.seed(1)
+        change_inputs()
+        baseline = measure(change, iterations)
+        legacy = measure(lambda: (change(), legacy_update()), iterations) - baseline
+        plan = measure(lambda: (change(), plan_update()), iterations) - baseline
+        results.extend(
+            (
+                ("per-tick path formatting, %s inputs" % name, legacy),
+                ("precompiled publish plan, %s inputs" % name, plan),
+                ("speedup, %s inputs" % name, legacy / plan),
+            )
+        )
+
+    report("µs per tick without sending the signal, %d iterations, %d phases" % (iterations, len(phases)), results)
+
+    host._energy_storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Compares the cost of handling 1000 grid and battery changes, one second of a busy system, with the
+# routing table of the EmulatorHost and with the previous handler, which decided the kind of the
+# service and copied the value for every change. With one grid meter and one battery the routed
+# changes are only counted, their values are read from the DbusMonitor. With a second grid meter and
+# battery, which do not change, the routed changes also update the combined values.
+#   dbus-run-session -- python benchmark/routing.py
+
+import sys
+
+from dbus.mainloop.glib import DBusGMainLoop
+
+from helpers import load_emulator, measure, report
+
+from dbusmonitor import BoundValue
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+changes_per_second = 1000
+# changes delivered together by the DbusMonitor in one main loop iteration
+batch_size = 10
+
+
+def main():
+    DBusGMainLoop(set_as_default=True)
+    emulator_module = load_emulator()
+
+    class EmulatorHost(emulator_module.EmulatorHost):
+        # no inputs needed, the changes are given by the benchmark
+        def _create_dbus_monitor(self, *args, **kwargs):
+            return None
+
+    class DbusMonitor:
+        # the values a route reads when its service is added and the values of a single service
+        def get_value(self, serviceName, objectPath, default_value=None):
+            return default_value
+
+        def bind_value(self, service, objectPath, default_value=None):
+            return BoundValue(service, objectPath, default_value)
+
+    host = EmulatorHost(
+        [{"servicename": "com.victronenergy.vebus.benchmark", "deviceinstance": 275}],
+        emulator_module.get_paths_dbus(),
+    )
+    # read or combine the values of the grid meters and batteries like the started host does
+    host._dbusmonitor = DbusMonitor()
+    host._bind_inputs("battery", host.batteryValues)
+    host._bind_inputs("grid", host.gridValues)
+
+    # a grid meter and a battery which are used and a PV inverter meter which is not
+    grid_paths = ("/Ac/L1/Power", "/Ac/L1/Current", "/Ac/L1/Voltage", "/Ac/Power")
+    battery_paths = ("/Dc/0/Power", "/Dc/0/Current", "/Dc/0/Voltage", "/Soc")
+    sources = (
+        ("com.victronenergy.grid.benchmark", grid_paths),
+        ("com.victronenergy.battery.benchmark", battery_paths),
+        ("com.victronenergy.pvinverter.benchmark", grid_paths),
+    )
+    for service, paths in sources:
+        host._device_added(service, 0)
+
+    changes = []
+    while len(changes) < changes_per_second:
+        service, paths = sources[len(changes) % len(sources)]
+        path = paths[len(changes) // len(sources) % len(paths)]
+        changes.append((service, path, {}, {"Value": float(len(changes))}, 0))
+    batches = [changes[i : i + batch_size] for i in range(0, len(changes), batch_size)]
+
+    grid_values, battery_values = emulator_module.create_input_values()
+    input_changes = {}
+
+    # the handler as it was before the routing table, as reference
+    def legacy_value_changed(dbusServiceName, dbusPath, dict, changes, deviceInstance):
+        host._changed = True
+
+        kind = emulator_module.get_input_kind(dbusServiceName)
+
+        if kind is not None:
+            input_changes[dbusServiceName] = input_changes.get(dbusServiceName, 0) + 1
+
+        if kind == "battery":
+            battery_values.update({str(dbusPath): changes["Value"]})
+            if dbusPath == "/Dc/0/Power":
+                host._sample_energy()
+            host._schedule_recompute()
+
+        elif kind == "grid":
+            grid_values.update({str(dbusPath): changes["Value"]})
+            if dbusPath.endswith("/Power"):
+                host._sample_energy()
+            host._schedule_recompute()
+
+    def legacy():
+        for change in changes:
+            legacy_value_changed(*change)
+
+    def routed():
+        for batch in batches:
+            host._dbus_values_changed(batch)
+
+    legacy_us = measure(legacy, iterations)
+    routed_us = measure(routed, iterations)
+
+    for service in ("com.victronenergy.grid.benchmark_2", "com.victronenergy.battery.benchmark_2"):
+        host._device_added(service, 1)
+    combined_us = measure(routed, iterations)
+
+    report(
+        "µs per second with %d changes/s in batches of %d, %d iterations" % (changes_per_second, batch_size, iterations),
+        (
+            ("kind and copy per change", legacy_us),
+            ("routing table, one grid meter and battery", routed_us),
+            ("speedup of the routing", legacy_us / routed_us),
+            ("routing table and combined values of two", combined_us),
+            ("speedup with combined values", legacy_us / combined_us),
+        ),
+    )
+
+    host._energy_storage.close()
+
+
+if __name__ == "__main__":
+    main()
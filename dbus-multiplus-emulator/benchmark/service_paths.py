@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Compares the time to add, delete and tear down 10000 paths of a VeDbusService with the child counts
+# per node and with the previous version, which joined every prefix when adding a path and checked
+# every node against every item when deleting one. Before the measurement, the nodes and their index
+# are checked against the previous version for paths that are an item and a prefix of other paths.
+#   dbus-run-session -- python benchmark/service_paths.py [paths] [deleted paths]
+
+import logging
+import sys
+from time import perf_counter
+
+import dbus
+from dbus.mainloop.glib import DBusGMainLoop
+
+from helpers import report
+
+from vedbus import VeDbusService, VeDbusItemExport, VeDbusTreeExport
+
+paths_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+# the previous version needs seconds per deleted path with 10000 paths, so only some are deleted one by one
+deleted_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+
+# the path handling as it was before the child counts, as reference
+class LegacyVeDbusService(VeDbusService):
+    def add_path(
+        self, path, value, description="", writeable=False, onchangecallback=None, gettextcallback=None, valuetype=None
+    ):
+        if onchangecallback is not None:
+            self._onchangecallbacks[path] = onchangecallback
+
+        item = VeDbusItemExport(
+            self._dbusconn,
+            path,
+            value,
+            description,
+            writeable,
+            self._value_changed,
+            gettextcallback,
+            deletecallback=self._item_deleted,
+            valuetype=valuetype,
+        )
+
+        spl = path.split("/")
+        for i in range(2, len(spl)):
+            subPath = "/".join(spl[:i])
+            if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
+                self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+        self._dbusobjects[path] = item
+
+    def _item_deleted(self, path):
+        self._dbusobjects.pop(path)
+        for np in list(self._dbusnodes.keys()):
+            if np != "/":
+                for ip in self._dbusobjects:
+                    if ip.startswith(np + "/"):
+                        break
+                else:
+                    self._dbusnodes[np].__del__()
+                    self._dbusnodes.pop(np)
+
+
+def make_paths():
+    # paths of several emulated units, e.g. /Unit3/Ac/Out/L2/P
+    paths = []
+    unit = 0
+    while len(paths) < paths_count:
+        for phase in ("L1", "L2", "L3"):
+            for prefix in ("/Ac/ActiveIn", "/Ac/Out"):
+                for leaf in ("I", "P", "S", "V", "F"):
+                    paths.append("/Unit%d%s/%s/%s" % (unit, prefix, phase, leaf))
+        for direction in range(20):
+            paths.append("/Unit%d/Energy/Direction%d" % (unit, direction))
+        for alarm in range(20):
+            paths.append("/Unit%d/Alarms/Alarm%d" % (unit, alarm))
+        unit += 1
+    return paths[:paths_count]
+
+
+def check_item_prefixes():
+    # each step adds a path or deletes one ("-/A/B"), after each step the nodes and the items indexed
+    # by each node have to match the previous version. A path that is a node can not be added as an
+    # item, D-Bus only allows one object per path.
+    steps = (
+        "/A/B", "/A/B/C", "-/A/B", "/A/B/E", "-/A/B/C", "/A/B/C/D", "-/A/B/E", "-/A/B/C/D",
+        "/A/B", "/A/B/C", "/A/B/C/D", "-/A/B/C", "-/A/B/C/D", "/X/Y", "-/A/B",
+    )
+    # the object paths of each service need their own connection
+    service = VeDbusService("com.victronenergy.vebus.benchmark_check", bus=dbus.SessionBus(private=True))
+    legacy = LegacyVeDbusService(
+        "com.victronenergy.vebus.benchmark_check_legacy", bus=dbus.SessionBus(private=True)
+    )
+    for step in steps:
+        for s in (service, legacy):
+            if step.startswith("-"):
+                del s[step[1:]]
+            else:
+                s.add_path(step, 0)
+        assert set(service._dbusnodes) == set(legacy._dbusnodes), (step, service._dbusnodes, legacy._dbusnodes)
+        for path, node in service._dbusnodes.items():
+            prefix = "/" if path == "/" else path + "/"
+            expected = {p[len(prefix):] for p in service._dbusobjects if p.startswith(prefix)}
+            assert set(node._items) == expected, (step, path, node._items, expected)
+    service.__del__()
+    legacy.__del__()
+
+
+def run(service_class, name, paths):
+    # returns the seconds to add all paths, to delete some paths one by one and to tear down the service
+    service = service_class(name)
+
+    start = perf_counter()
+    for path in paths:
+        service.add_path(path, 0)
+    added = perf_counter() - start
+
+    start = perf_counter()
+    for path in paths[-deleted_count:]:
+        del service[path]
+    deleted = perf_counter() - start
+
+    start = perf_counter()
+    service.__del__()
+    teardown = perf_counter() - start
+
+    return added, deleted, teardown
+
+
+def main():
+    DBusGMainLoop(set_as_default=True)
+    # the debug logging of every path would dominate the measurement
+    logging.getLogger().setLevel(logging.INFO)
+
+    check_item_prefixes()
+    paths = make_paths()
+    legacy = run(LegacyVeDbusService, "com.victronenergy.vebus.benchmark_legacy", paths)
+    counted = run(VeDbusService, "com.victronenergy.vebus.benchmark", paths)
+
+    report(
+        "%d paths, %d deleted one by one" % (len(paths), deleted_count),
+        (
+            ("ms to add, previous", legacy[0] * 1000),
+            ("ms to add, child counts", counted[0] * 1000),
+            ("µs per delete, previous", legacy[1] / deleted_count * 1e6),
+            ("µs per delete, child counts", counted[1] / deleted_count * 1e6),
+            ("ms to tear down, previous", legacy[2] * 1000),
+            ("ms to tear down, child counts", counted[2] * 1000),
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
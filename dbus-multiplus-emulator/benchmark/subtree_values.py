@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Compares the µs per GetValue and GetText of a node like /Ac/Out with the index of the items below
+# each node and the cached wrapped values, with the previous version, which checked every path of the
+# service and wrapped every value again. The service has the paths of several emulated devices.
+#   dbus-run-session -- python benchmark/subtree_values.py [paths]
+
+import logging
+import sys
+
+from dbus.mainloop.glib import DBusGMainLoop
+
+from helpers import measure, report
+
+from vedbus import VeDbusService
+from ve_utils import wrap_dbus_value
+
+paths_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+iterations = 1000
+
+
+# the handler as it was before the index, as reference
+def legacy_get_value_handler(node, path, get_text=False):
+    r = {}
+    px = path
+    if not px.endswith("/"):
+        px += "/"
+    for p, item in node._service._dbusobjects.items():
+        if p.startswith(px):
+            v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
+            r[p[len(px):]] = v
+    return r
+
+
+def main():
+    DBusGMainLoop(set_as_default=True)
+    # the debug logging of every path would dominate the measurement
+    logging.getLogger().setLevel(logging.INFO)
+
+    service = VeDbusService("com.victronenergy.vebus.benchmark")
+    unit = 0
+    while len(service._dbusobjects) < paths_count:
+        for prefix in ("/Ac/ActiveIn", "/Ac/Out"):
+            for phase in ("L1", "L2", "L3"):
+                for leaf in ("I", "P", "S", "V", "F"):
+                    service.add_path("/Unit%d%s/%s/%s" % (unit, prefix, phase, leaf), float(unit))
+        for number in range(40):
+            service.add_path("/Unit%d/Settings/Setting%d" % (unit, number), number)
+        unit += 1
+
+    path = "/Unit0/Ac/Out"
+    node = service._dbusnodes[path]
+
+    results = []
+    for name, get_text in (("GetValue", False), ("GetText", True)):
+        legacy_us = measure(lambda: legacy_get_value_handler(node, path, get_text), iterations)
+        indexed_us = measure(lambda: node._get_value_handler(path, get_text), iterations)
+        results.append(("%s, previous" % name, legacy_us))
+        results.append(("%s, subtree index" % name, indexed_us))
+
+    report(
+        "µs per query of %s with %d items in a service with %d paths"
+        % (path, len(node._items), len(service._dbusobjects)),
+        results,
+    )
+
+    service.__del__()
+
+
+if __name__ == "__main__":
+    main()
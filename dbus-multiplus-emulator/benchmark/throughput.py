@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# End-to-end benchmark of the emulator against fake grid meters and batteries on a private dbus-daemon.
+# Reports the signals per second sent and received by the emulator, the CPU time per update tick, the
+# latency from a grid meter update to the vebus output, which shows the sum of the meters, and the peak
+# RSS of the emulator process.
+#   python benchmark/throughput.py --grid-meters 2 --batteries 1 --rate 10 --duration 60
+# Other services, which the emulator does not monitor, show the effect of the scoped match rules:
+#   python benchmark/throughput.py --other-services 10 [--unscoped]
+# The dbus-daemon is started by the benchmark, so it does not disturb the running system.
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from helpers import load_emulator, report
+
+benchmark_file = os.path.realpath(__file__)
+
+
+def run_emulator(metrics_address, unscoped):
+    # the emulator with its energy files redirected to a temporary folder, without the benchmark arguments
+    sys.argv = sys.argv[:1]
+    emulator = load_emulator()
+    emulator.config_defaults["metrics_address"] = metrics_address
+    emulator.monitor_scoped_signals = not unscoped
+    emulator.main()
+
+
+def run_producer(kind, number, rate):
+    from dbus.mainloop.glib import DBusGMainLoop
+    from gi.repository import GLib
+    from vedbus import VeDbusService
+
+    DBusGMainLoop(set_as_default=True)
+    service = VeDbusService("com.victronenergy.%s.benchmark_%d" % (kind, number))
+    service.add_path("/DeviceInstance", 100 + number)
+    service.add_path("/Connected", 1)
+
+    if kind == "grid":
+        for phase in ("L1", "L2", "L3"):
+            service.add_path(f"/Ac/{phase}/Power", 0)
+            service.add_path(f"/Ac/{phase}/Voltage", 230)
+            service.add_path(f"/Ac/{phase}/Current", 0)
+        service.add_path("/Ac/Power", 0)
+    elif kind == "battery":
+        service.add_path("/Dc/0/Power", 0)
+        service.add_path("/Dc/0/Current", 0)
+        service.add_path("/Dc/0/Voltage", 52)
+        service.add_path("/Soc", 50)
+    else:
+        service.add_path("/Yield/Power", 0)
+        service.add_path("/Dc/0/Current", 0)
+        service.add_path("/Pv/V", 0)
+
+    # unique values per producer, so the observer can match the vebus output to the meter update
+    sequence = [0]
+
+    def publish():
+        sequence[0] = (sequence[0] + 1) % 100000
+        value = number * 100000 + sequence[0]
+        with service as s:
+            if kind == "grid":
+                s["/Ac/L1/Power"] = value
+                s["/Ac/L2/Power"] = value % 1000
+                s["/Ac/L3/Power"] = -(value % 1000)
+                s["/Ac/Power"] = value
+            elif kind == "battery":
+                s["/Dc/0/Power"] = value
+                s["/Dc/0/Current"] = round(value / 52, 1)
+            else:
+                s["/Yield/Power"] = value
+                s["/Dc/0/Current"] = round(value / 52, 1)
+                s["/Pv/V"] = value % 100
+        return True
+
+    GLib.timeout_add(max(1, int(1000 / rate)), publish)
+    GLib.MainLoop().run()
+
+
+def start_dbus_daemon():
+    daemon = subprocess.Popen(
+        ["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    address = daemon.stdout.readline().strip()
+    os.environ["DBUS_SESSION_BUS_ADDRESS"] = address
+    return daemon
+
+
+def proc_cpu_seconds(pid):
+    with open("/proc/%d/stat" % pid) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are the 12th and 13th field after the process name
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def proc_peak_rss_kb(pid):
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def signals_received(metrics_address):
+    # reads the change signals delivered to the DbusMonitor of the emulator from its metrics
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(metrics_address)
+    client.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+    response = b""
+    while True:
+        data = client.recv(65536)
+        if not data:
+            break
+        response += data
+    client.close()
+    for line in response.decode().splitlines():
+        if line.startswith("dbus_multiplus_emulator_signals_received_total "):
+            return int(line.split()[1])
+    return 0
+
+
+def wait_for_names(bus, names, timeout=30):
+    end = time.monotonic() + timeout
+    for name in names:
+        while not bus.name_has_owner(name):
+            if time.monotonic() > end:
+                raise RuntimeError("%s did not appear on the bus" % name)
+            time.sleep(0.1)
+
+
+def observe(args, emulator):
+    import dbus
+    from dbus.mainloop.glib import DBusGMainLoop
+    from gi.repository import GLib
+    from ve_utils import unwrap_dbus_value
+
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.SessionBus()
+    vebus = "com.victronenergy.vebus.ttyS3"
+    grid_names = ["com.victronenergy.grid.benchmark_%d" % number for number in range(args.grid_meters)]
+    wait_for_names(bus, grid_names + [vebus])
+
+    # give the emulator the time to scan the producers before measuring
+    time.sleep(2)
+
+    stats = {"signals": 0, "ticks": 0, "latencies": []}
+    # the emulator publishes the sum of the L1 power of all meters, so the sums are matched
+    meter_power = {}
+    sent = {}
+
+    def grid_changed(name, items):
+        if "/Ac/L1/Power" in items:
+            meter_power[name] = unwrap_dbus_value(items["/Ac/L1/Power"]["Value"])
+            if len(meter_power) == len(grid_names):
+                sent[sum(meter_power.values())] = time.monotonic()
+
+    def vebus_signal(*args, **kwargs):
+        stats["signals"] += 1
+
+    def vebus_changed(items):
+        stats["ticks"] += 1
+        if "/Ac/ActiveIn/L1/P" in items:
+            sent_time = sent.pop(unwrap_dbus_value(items["/Ac/ActiveIn/L1/P"]["Value"]), None)
+            if sent_time is not None:
+                stats["latencies"].append(time.monotonic() - sent_time)
+
+    for name in grid_names:
+        bus.add_signal_receiver(
+            lambda items, name=name: grid_changed(name, items),
+            signal_name="ItemsChanged",
+            dbus_interface="com.victronenergy.BusItem",
+            path="/",
+            bus_name=name,
+        )
+    bus.add_signal_receiver(vebus_signal, bus_name=vebus)
+    bus.add_signal_receiver(
+        vebus_changed, signal_name="ItemsChanged", dbus_interface="com.victronenergy.BusItem", path="/", bus_name=vebus
+    )
+
+    cpu_start = proc_cpu_seconds(emulator.pid)
+    received_start = signals_received(args.metrics_address)
+    mainloop = GLib.MainLoop()
+    GLib.timeout_add_seconds(args.duration, mainloop.quit)
+    mainloop.run()
+    cpu = proc_cpu_seconds(emulator.pid) - cpu_start
+    received = signals_received(args.metrics_address) - received_start
+
+    latencies = sorted(stats["latencies"])
+    if not latencies:
+        raise RuntimeError("No vebus update matched a grid meter update, the latency can not be measured")
+    report(
+        "%d grid meters, %d batteries, %d other services at %.1f Hz for %d s, %s match rules"
+        % (
+            args.grid_meters,
+            args.batteries,
+            args.other_services,
+            args.rate,
+            args.duration,
+            "bus-wide" if args.unscoped else "scoped",
+        ),
+        (
+            ("input updates per second", (args.grid_meters + args.batteries) * args.rate),
+            ("signals received by the emulator per second", received / args.duration),
+            ("emulator signals per second", stats["signals"] / args.duration),
+            ("emulator ticks per second", stats["ticks"] / args.duration),
+            ("CPU ms per tick (whole process)", cpu * 1000 / max(1, stats["ticks"])),
+            ("CPU % of one core", cpu * 100 / args.duration),
+            ("latency meter to vebus median ms", latencies[len(latencies) // 2] * 1000),
+            ("latency meter to vebus p95 ms", latencies[int(len(latencies) * 0.95)] * 1000),
+            ("latency meter to vebus max ms", latencies[-1] * 1000),
+            ("peak RSS emulator kB", proc_peak_rss_kb(emulator.pid)),
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against a private dbus-daemon")
+    parser.add_argument("--grid-meters", type=int, default=1)
+    parser.add_argument("--batteries", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=5, help="updates per second of each producer")
+    parser.add_argument("--duration", type=int, default=30, help="seconds to measure")
+    parser.add_argument(
+        "--other-services", type=int, default=0, help="solar chargers, which are not monitored by the emulator"
+    )
+    parser.add_argument(
+        "--unscoped", action="store_true", help="receive the change signals of all services like before"
+    )
+    parser.add_argument("--metrics-address", help=argparse.SUPPRESS)
+    parser.add_argument("--run-emulator", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--run-producer", nargs=2, metavar=("KIND", "NUMBER"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_emulator:
+        return run_emulator(args.metrics_address, args.unscoped)
+    if args.run_producer:
+        return run_producer(args.run_producer[0], int(args.run_producer[1]), args.rate)
+
+    daemon = start_dbus_daemon()
+    args.metrics_address = os.path.join(tempfile.mkdtemp(prefix="dbus-multiplus-emulator-benchmark-"), "metrics.sock")
+    processes = []
+    try:
+        for kind, count in (
+            ("grid", args.grid_meters),
+            ("battery", args.batteries),
+            ("solarcharger", args.other_services),
+        ):
+            for number in range(count):
+                processes.append(
+                    subprocess.Popen(
+                        [sys.executable, benchmark_file, "--rate", str(args.rate), "--run-producer", kind, str(number)]
+                    )
+                )
+        emulator_args = [sys.executable, benchmark_file, "--run-emulator", "--metrics-address", args.metrics_address]
+        if args.unscoped:
+            emulator_args.append("--unscoped")
+        emulator = subprocess.Popen(emulator_args)
+        processes.append(emulator)
+        observe(args, emulator)
+    finally:
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            process.wait()
+        daemon.terminate()
+        daemon.wait()
+
+
+if __name__ == "__main__":
+    main()
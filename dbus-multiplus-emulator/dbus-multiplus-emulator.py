@@ -1,18 +1,34 @@
 #!/usr/bin/env python
 
-from gi.repository import GLib
+from time import perf_counter
+
+# start of the imports for --profile-startup
+startup_start = perf_counter()
+
+from gi.repository import GLib, Gio
+import dbus
 import platform
 import logging
 import sys
 import os
 import _thread
-from time import time
+import threading
+import signal
+import socket
+import zlib
+from bisect import bisect_left
+from time import time, monotonic, thread_time
+from itertools import islice
 import json
+import csv
+import argparse
+import configparser
 
 # import Victron Energy packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
 from vedbus import VeDbusService
-from dbusmonitor import DbusMonitor
+from ve_utils import wrap_dbus_value
+from dbusmonitor import DbusMonitor, BoundValue
 
 # Configure logging
 log_dir = os.path.dirname(os.path.realpath(__file__))
@@ -30,6 +46,9 @@ logging.basicConfig(
 
 # ------------------ USER CHANGABLE VALUES | START ------------------
 
+# these are the defaults, to change them copy config.sample.ini to config.ini and edit it there
+# changes of config.ini are applied while the driver is running
+
 # enter grid frequency
 grid_frequency = 50.0000
 
@@ -41,17 +60,73 @@ dbusServiceNameBattery = ""
 # e.g. com.victronenergy.grid.mqtt_grid_31
 dbusServiceNameGrid = ""
 
+# how the values of several batteries or grid meters are combined, if no dbusServiceName is entered
+# sum: added up, mean: average, first: from the first service found that has a value
+# a path: average weighted by the value of this path of each service, e.g. the SOC by the capacity
+aggregation_modes = {
+    "/Ac/L1/Power": "sum",
+    "/Ac/L2/Power": "sum",
+    "/Ac/L3/Power": "sum",
+    "/Ac/L1/Current": "sum",
+    "/Ac/L2/Current": "sum",
+    "/Ac/L3/Current": "sum",
+    "/Ac/L1/Voltage": "mean",
+    "/Ac/L2/Voltage": "mean",
+    "/Ac/L3/Voltage": "mean",
+    "/Ac/Power": "sum",
+    "/Ac/Current": "sum",
+    "/Ac/Voltage": "mean",
+    "/Dc/0/Current": "sum",
+    "/Dc/0/Power": "sum",
+    "/Dc/0/Temperature": "mean",
+    "/Dc/0/Voltage": "mean",
+    "/Soc": "/InstalledCapacity",
+    "/Info/ChargeMode": "first",
+    "/Info/MaxChargeCurrent": "sum",
+    "/Info/MaxChargeVoltage": "first",
+    "/Info/MaxDischargeCurrent": "sum",
+}
+
 # specify on which phase the AC PV Inverter is connected
 # e.g. L1, L2 or L3
 # default: L1
 phases = ["L1", "L2", "L3"]
 
+# emulated VE.Bus devices, add one entry per device e.g. to emulate one device per phase
+# each device needs its own servicename and deviceinstance and shows the given phases of the grid meter
+# default: one device with all phases
+units = [
+    {"servicename": "com.victronenergy.vebus.ttyS3", "deviceinstance": 275, "phases": phases},
+]
+
+# minimum time in milliseconds between two updates triggered by a change of the grid or battery values
+# a change is published with at most this delay, without changes the values are still updated regularly
+# default: 100
+update_min_interval = 100
+
+# the update interval adapts to the grid and battery power
+# interval in milliseconds while the power is changing and when the power is flat
+# default: 250 and 5000
+update_interval_fast = 250
+update_interval_slow = 5000
+
+# change of the grid or battery power in W between two updates, which switches to the fast interval
+# default: 50
+update_power_threshold = 50
+
+# seconds over which the tick performance counters in /Mgmt/Perf are aggregated and published
+# default: 10
+perf_window = 10
+
+# serve OpenMetrics text for Prometheus on this address, disabled when empty
+# e.g. "127.0.0.1:9480" for HTTP on TCP or "/var/run/dbus-multiplus-emulator.sock" for a unix socket
+# default: ""
+metrics_address = ""
+
 # ------------------ USER CHANGABLE VALUES | END --------------------
 
 
-# create dictionary for later to count watt hours
-data_watt_hours = {"time_creation": int(time()), "count": 0}
-# calculate and save watthours after every x seconds
+# save watthours to the working file after every x seconds
 data_watt_hours_timespan = 60
 # save file to non volatile storage after x seconds
 data_watt_hours_save = 900
@@ -61,47 +136,916 @@ data_watt_hours_storage_file = "/data/etc/dbus-multiplus-emulator/data_watt_hour
 data_watt_hours_working_file = (
     "/var/volatile/tmp/dbus-multiplus-emulator_data_watt_hours.json"
 )
-# get last modification timestamp
-timestamp_storage_file = (
-    os.path.getmtime(data_watt_hours_storage_file)
-    if os.path.isfile(data_watt_hours_storage_file)
-    else 0
+# journal on persistent storage, which gets a line appended every data_watt_hours_save seconds
+data_watt_hours_journal_file = "/data/etc/dbus-multiplus-emulator/data_watt_hours.journal"
+
+# config file that overrides the defaults above
+config_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.ini")
+
+# option in the DEFAULT section of the config file and the global it sets
+config_options = {
+    "grid_frequency": "grid_frequency",
+    "battery_service": "dbusServiceNameBattery",
+    "grid_service": "dbusServiceNameGrid",
+    "phases": "phases",
+    "update_min_interval": "update_min_interval",
+    "update_interval_fast": "update_interval_fast",
+    "update_interval_slow": "update_interval_slow",
+    "update_power_threshold": "update_power_threshold",
+    "perf_window": "perf_window",
+    "metrics_address": "metrics_address",
+    "data_watt_hours_timespan": "data_watt_hours_timespan",
+    "data_watt_hours_save": "data_watt_hours_save",
+    "data_watt_hours_storage_file": "data_watt_hours_storage_file",
+    "data_watt_hours_working_file": "data_watt_hours_working_file",
+    "data_watt_hours_journal_file": "data_watt_hours_journal_file",
+}
+# defaults of the globals, used for options that are not in the config file
+config_defaults = {
+    name: globals()[name] for name in list(config_options.values()) + ["units", "aggregation_modes"]
+}
+
+# paths that are added together with the derived paths before the name is used, so the device is
+# valid right away, the other paths are added in blocks of startup_paths_per_idle once the main loop runs
+startup_paths = (
+    "/Ac/ActiveIn/ActiveInput",
+    "/Ac/ActiveIn/Connected",
+    "/Ac/NumberOfAcInputs",
+    "/Ac/Out/NominalInverterPower",
+    "/Ac/PowerMeasurementType",
+    "/Mode",
+    "/State",
+    "/UpdateIndex",
+    "/VebusChargeState",
+    "/VebusError",
+    "/VebusMainState",
+)
+startup_paths_per_idle = 50
+
+# only receive the change signals of the grid and battery services instead of those of all services
+monitor_scoped_signals = True
+
+# file the received grid and battery changes are recorded to with --record (on ramdisk)
+record_file = "/var/volatile/tmp/dbus-multiplus-emulator_trace.jsonl"
+# write the recorded changes in blocks of x lines or at least every x seconds
+record_block_lines = 1000
+record_flush_interval = 10
+
+
+class StartupProfile:
+    """Measures the duration of the startup phases, which are logged with --profile-startup."""
+
+    def __init__(self, start):
+        self.enabled = False
+        self._start = start
+        self._last = start
+        self.phases = []
+
+    def mark(self, phase):
+        now = perf_counter()
+        self.phases.append((phase, now - self._last, now - self._start))
+        self._last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        logging.info("Startup profile (ms since the start of the imports):")
+        for phase, duration, total in self.phases:
+            logging.info("  %-32s %8.1f ms  at %8.1f ms" % (phase, duration * 1000, total * 1000))
+
+
+startup_profile = StartupProfile(startup_start)
+
+
+def parse_phases(value):
+    # "L1, L2" -> ["L1", "L2"]
+    result = [phase.strip() for phase in value.split(",") if phase.strip()]
+    for phase in result:
+        if phase not in ("L1", "L2", "L3"):
+            raise ValueError("Unknown phase %s" % phase)
+    if not result:
+        raise ValueError("No phase given")
+    return result
+
+
+def parse_aggregation_mode(value):
+    value = value.strip()
+    if value not in ("sum", "mean", "first") and not value.startswith("/"):
+        raise ValueError("Unknown aggregation mode %s" % value)
+    return value
+
+
+def read_config(file):
+    """
+    Returns the values of the config file by the name of their global, with the defaults for
+    missing options. Each UNIT section adds an emulated device; without one the default device
+    shows the configured phases. The AGGREGATION section overrides the aggregation mode of paths.
+    """
+    config = configparser.ConfigParser()
+    # the paths in the AGGREGATION section are case sensitive
+    config.optionxform = str
+    config.read(file)
+
+    values = dict(config_defaults)
+    for option, name in config_options.items():
+        if option not in config["DEFAULT"]:
+            continue
+        value = config["DEFAULT"][option].strip()
+        default = config_defaults[name]
+        try:
+            if name == "phases":
+                values[name] = parse_phases(value)
+            elif isinstance(default, str):
+                values[name] = value.strip('"')
+            elif isinstance(default, int):
+                # "100.5" is accepted for an option in milliseconds or watts
+                values[name] = int(float(value))
+            else:
+                values[name] = type(default)(value)
+        except ValueError as e:
+            raise ValueError("Invalid value %r for option %s: %s" % (value, option, str(e)))
+
+    sections = [section for section in config.sections() if section.upper().startswith("UNIT")]
+    if sections:
+        values["units"] = [
+            {
+                "servicename": config[section]["servicename"].strip(),
+                "deviceinstance": config[section].getint("deviceinstance"),
+                # the phases of the DEFAULT section apply if a unit does not have its own
+                "phases": parse_phases(config[section]["phases"])
+                if "phases" in config[section]
+                else values["phases"],
+            }
+            for section in sections
+        ]
+    else:
+        values["units"] = [dict(unit, phases=values["phases"]) for unit in config_defaults["units"]]
+
+    values["aggregation_modes"] = dict(config_defaults["aggregation_modes"])
+    if config.has_section("AGGREGATION"):
+        for path, mode in config.items("AGGREGATION"):
+            # the section also contains the options of the DEFAULT section
+            if path.startswith("/"):
+                values["aggregation_modes"][path] = parse_aggregation_mode(mode)
+
+    return values
+
+
+def apply_config(values):
+    globals().update(values)
+
+
+# energy directions, the D-Bus path is /Energy/<direction>
+energy_directions = (
+    "AcIn1ToAcOut",
+    "AcIn1ToInverter",
+    "AcIn2ToAcOut",
+    "AcIn2ToInverter",
+    "AcOutToAcIn1",
+    "AcOutToAcIn2",
+    "InverterToAcIn1",
+    "InverterToAcIn2",
+    "InverterToAcOut",
+    "OutToInverter",
 )
 
-# load data to prevent sending 0 watthours for OutToInverter (charging)/InverterToOut (discharging) before the first loop
-# check if file in volatile storage exists
-if os.path.isfile(data_watt_hours_working_file):
-    with open(data_watt_hours_working_file, "r") as file:
-        file = open(data_watt_hours_working_file, "r")
-        json_data = json.load(file)
-        logging.info(
-            "Loaded JSON for OutToInverter (charging)/InverterToOut (discharging) once"
-        )
-        logging.debug(json.dumps(json_data))
-# if not, check if file in persistent storage exists
-elif os.path.isfile(data_watt_hours_storage_file):
-    with open(data_watt_hours_storage_file, "r") as file:
-        file = open(data_watt_hours_storage_file, "r")
-        json_data = json.load(file)
-        logging.info(
-            "Loaded JSON for OutToInverter (charging)/InverterToOut (discharging) once from persistent storage"
+# indexes of the directions with a power flow, AcIn2 is never used
+AC_IN1_TO_AC_OUT = energy_directions.index("AcIn1ToAcOut")
+AC_IN1_TO_INVERTER = energy_directions.index("AcIn1ToInverter")
+AC_OUT_TO_AC_IN1 = energy_directions.index("AcOutToAcIn1")
+INVERTER_TO_AC_IN1 = energy_directions.index("InverterToAcIn1")
+INVERTER_TO_AC_OUT = energy_directions.index("InverterToAcOut")
+OUT_TO_INVERTER = energy_directions.index("OutToInverter")
+
+# marks values of a replay that were not written yet, None is a valid value
+notwritten = object()
+
+# slots of the values computed by VebusValues.compute in each tick
+(
+    SLOT_AC_POWER,
+    SLOT_MAX_CHARGE_CURRENT,
+    SLOT_MAX_CHARGE_VOLTAGE,
+    SLOT_MAX_DISCHARGE_CURRENT,
+    SLOT_DC_CURRENT,
+    SLOT_DC_POWER,
+    SLOT_DC_TEMPERATURE,
+    SLOT_DC_VOLTAGE,
+    SLOT_LED_ABSORPTION,
+    SLOT_LED_BULK,
+    SLOT_LED_FLOAT,
+    SLOT_SOC,
+    SLOT_ENERGY,
+) = range(13)
+# followed by one slot per energy direction and three slots (current, power, voltage) per phase
+SLOT_PHASES = SLOT_ENERGY + len(energy_directions)
+
+
+class EnergyCounters:
+    """
+    Integrates the grid and battery power into the energy counters of all directions.
+
+    The power of each direction is integrated with the trapezoidal rule on a monotonic clock.
+    A sample does O(1) work and reuses preallocated lists, so it can be called for every
+    received power value.
+    """
+
+    # do not integrate over gaps longer than this many seconds, e.g. after a suspended process
+    max_gap = 60
+
+    def __init__(self, kwh=None):
+        # counters in kWh, indexed like energy_directions
+        self.kwh = [0.0] * len(energy_directions)
+        if kwh is not None:
+            for index, direction in enumerate(energy_directions):
+                self.kwh[index] = float(kwh.get(direction, 0) or 0)
+
+        self._indexes = tuple(range(len(energy_directions)))
+        self._last_flows = [0.0] * len(energy_directions)
+        self._flows = [0.0] * len(energy_directions)
+        self._last_time = None
+
+    @staticmethod
+    def _split(grid_power, battery_power, flows):
+        # split the grid power (positive = import) and the battery power (positive = charging)
+        # into the power of each direction. AC out is fed by the grid as long as it is imported
+        imported = grid_power if grid_power > 0 else 0
+        exported = -grid_power if grid_power < 0 else 0
+        charging = battery_power if battery_power > 0 else 0
+        discharging = -battery_power if battery_power < 0 else 0
+
+        grid_to_battery = imported if imported < charging else charging
+        battery_to_grid = exported if exported < discharging else discharging
+
+        flows[AC_IN1_TO_AC_OUT] = imported - grid_to_battery
+        flows[AC_IN1_TO_INVERTER] = grid_to_battery
+        flows[AC_OUT_TO_AC_IN1] = exported - battery_to_grid
+        flows[INVERTER_TO_AC_IN1] = battery_to_grid
+        flows[INVERTER_TO_AC_OUT] = discharging - battery_to_grid
+        flows[OUT_TO_INVERTER] = charging - grid_to_battery
+
+    def sample(self, grid_power, battery_power, now=None):
+        if now is None:
+            now = monotonic()
+
+        flows = self._flows
+        self._split(grid_power, battery_power, flows)
+
+        if self._last_time is not None:
+            elapsed = now - self._last_time
+            if 0 < elapsed <= self.max_gap:
+                # mean power of both samples in W multiplied with the elapsed hours, in kWh
+                factor = elapsed / 7200000
+                last_flows = self._last_flows
+                kwh = self.kwh
+                for index in self._indexes:
+                    kwh[index] += (last_flows[index] + flows[index]) * factor
+
+        self._flows = self._last_flows
+        self._last_flows = flows
+        self._last_time = now
+
+    def as_dict(self):
+        return {direction: self.kwh[index] for index, direction in enumerate(energy_directions)}
+
+
+def load_energy_counters(data):
+    # the energy was saved as "dc" with charging/discharging before all directions were counted
+    if "energy" in data:
+        return EnergyCounters(data["energy"])
+
+    dc = data.get("dc", {})
+    return EnergyCounters(
+        {
+            "InverterToAcOut": dc.get("discharging", 0),
+            "OutToInverter": dc.get("charging", 0),
+        }
+    )
+
+
+class EnergyStorage:
+    """
+    Saves the energy counters crash-consistent without blocking the GLib main loop.
+
+    Files are written to a temporary file and renamed atomically. The persistent storage
+    only gets a checksummed line appended to its journal after every data_watt_hours_save
+    seconds and on shutdown, so a power cut loses at most one interval. Once the journal
+    has journal_max_lines lines it is compacted into the storage file. All writes run in
+    a separate thread, so a slow SD card does not delay D-Bus replies.
+    """
+
+    # compact the journal after one day with the default save interval
+    journal_max_lines = 96
+
+    def __init__(self, working_file, storage_file, journal_file):
+        self.working_file = working_file
+        self.storage_file = storage_file
+        self.journal_file = journal_file
+        self._journal_lines = 0
+
+        # latest data to write per file, written by the thread in one batch
+        self._pending = {}
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="EnergyStorage", daemon=True)
+        self._thread.start()
+
+    def load(self):
+        # the working file is the newest, but does not survive a reboot
+        data = self._read_json(self.working_file)
+        if data is not None:
+            logging.info("Loaded energy counters from %s" % self.working_file)
+            return data
+
+        # the last valid journal line is newer than the compacted storage file
+        data = self._read_journal()
+        if data is not None:
+            logging.info("Loaded energy counters from %s" % self.journal_file)
+            return data
+
+        data = self._read_json(self.storage_file)
+        if data is not None:
+            logging.info("Loaded energy counters from %s" % self.storage_file)
+            return data
+
+        return {}
+
+    def save_working(self, data):
+        self._queue(self.working_file, data)
+
+    def save_storage(self, data):
+        self._queue(self.journal_file, data)
+
+    def close(self, timeout=10):
+        # write the pending data and stop the thread
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _queue(self, file, data):
+        with self._condition:
+            self._pending[file] = data
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, {}
+
+            for file, data in pending.items():
+                try:
+                    if file == self.journal_file:
+                        self._append_journal(data)
+                    else:
+                        self._write_atomic(file, data)
+                except Exception as e:
+                    logging.error("Error saving energy counters to %s: %s" % (file, str(e)))
+
+    @staticmethod
+    def _fsync_dir(directory):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_atomic(self, file, data):
+        directory = os.path.dirname(file)
+        os.makedirs(directory, exist_ok=True)
+        tmp_file = file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file)
+        self._fsync_dir(directory)
+        logging.debug("Saved energy counters to %s" % file)
+
+    def _append_journal(self, data):
+        os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+        line = json.dumps(data, separators=(",", ":"))
+        with open(self.journal_file, "a") as f:
+            f.write("%s %08x\n" % (line, zlib.crc32(line.encode())))
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_lines += 1
+        logging.debug("Appended energy counters to %s" % self.journal_file)
+
+        if self._journal_lines >= self.journal_max_lines:
+            # the storage file has to be complete before the journal is emptied
+            self._write_atomic(self.storage_file, data)
+            with open(self.journal_file, "w") as f:
+                os.fsync(f.fileno())
+            self._journal_lines = 0
+
+    @staticmethod
+    def _read_json(file):
+        try:
+            with open(file, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error("Error loading energy counters from %s: %s" % (file, str(e)))
+            return None
+
+    def _read_journal(self):
+        data = None
+        try:
+            with open(self.journal_file, "r") as f:
+                for line in f:
+                    self._journal_lines += 1
+                    # a line torn by a power cut has no or a wrong checksum
+                    content, _, checksum = line.rstrip("\n").rpartition(" ")
+                    try:
+                        if int(checksum, 16) == zlib.crc32(content.encode()):
+                            data = json.loads(content)
+                    except ValueError:
+                        pass
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error("Error loading energy counters from %s: %s" % (self.journal_file, str(e)))
+        return data
+
+
+class TraceRecorder:
+    """
+    Records received grid and battery changes as JSON lines [time, service, path, value],
+    which can be replayed with --replay. The host also records the current values of a service
+    when it is found and None values when it goes away, see EmulatorHost._record_route.
+
+    The lines are buffered in memory and appended to the file in blocks of
+    record_block_lines lines or every record_flush_interval seconds, so recording does not
+    cause a write for every change.
+    """
+
+    def __init__(self, file, block_lines=record_block_lines):
+        self.file = file
+        self.block_lines = block_lines
+        self.records = 0
+        self._buffer = []
+        os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+        logging.info("Recording grid and battery changes to %s" % file)
+
+    def record(self, service, path, value):
+        self._buffer.append(
+            json.dumps([round(time(), 3), service, path, value], separators=(",", ":")) + "\n"
         )
-        logging.debug(json.dumps(json_data))
-else:
-    json_data = {}
+        if len(self._buffer) >= self.block_lines:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return True
+        buffer, self._buffer = self._buffer, []
+        try:
+            with open(self.file, "a") as f:
+                f.write("".join(buffer))
+            self.records += len(buffer)
+        except Exception as e:
+            logging.error("Error writing recorded changes to %s: %s" % (self.file, str(e)))
+        return True
+
+
+def create_input_values():
+    grid_values = {
+        "/Ac/L1/Power": None,
+        "/Ac/L2/Power": None,
+        "/Ac/L3/Power": None,
+        "/Ac/L1/Current": None,
+        "/Ac/L2/Current": None,
+        "/Ac/L3/Current": None,
+        "/Ac/L1/Voltage": None,
+        "/Ac/L2/Voltage": None,
+        "/Ac/L3/Voltage": None,
+        # ---
+        "/Ac/Power": None,
+        "/Ac/Current": None,
+        "/Ac/Voltage": None,
+    }
+
+    battery_values = {
+        "/Dc/0/Current": None,
+        "/Dc/0/Power": None,
+        "/Dc/0/Temperature": None,
+        "/Dc/0/Voltage": None,
+        "/Soc": None,
+        "/Info/ChargeMode": "",
+        "/Info/MaxChargeCurrent": None,
+        "/Info/MaxChargeVoltage": None,
+        "/Info/MaxDischargeCurrent": None,
+    }
+
+    return grid_values, battery_values
+
+
+def create_unbound_input_values():
+    # values that are not read from the DbusMonitor, until the monitor is started
+    return tuple(
+        {path: BoundValue(None, path, default) for path, default in values.items()}
+        for values in create_input_values()
+    )
+
+
+# paths which change the energy, by kind of the input
+input_sample_paths = {
+    "battery": frozenset(("/Dc/0/Power",)),
+    "grid": frozenset(path for path in create_input_values()[0] if path.endswith("/Power")),
+}
+
+
+def get_weight_paths(kind):
+    # paths of the weights of the weighted values of the kind, which also have to be monitored
+    defaults = create_input_values()[0 if kind == "grid" else 1]
+    return sorted(
+        {aggregation_modes[path] for path in defaults if aggregation_modes.get(path, "first").startswith("/")}
+    )
+
+
+def create_aggregated_input_values(kind):
+    """
+    Returns the values of the kind by path as Aggregates of all services of the kind, and the
+    handlers of the changes of the services by path. A handler is called with the service name
+    and the new value.
+    """
+    values = {}
+    handlers = {}
+    for path, default in create_input_values()[0 if kind == "grid" else 1].items():
+        mode = aggregation_modes.get(path, "first")
+        aggregate = values[path] = Aggregate(mode, default)
+        handlers.setdefault(path, []).append(aggregate.set_value)
+        if mode.startswith("/"):
+            handlers.setdefault(mode, []).append(aggregate.set_weight)
+    return values, {path: tuple(path_handlers) for path, path_handlers in handlers.items()}
+
+
+def get_input_kind(dbusServiceName):
+    # returns if the service provides the "battery" or the "grid" values, None if it is not used
+    if (
+        dbusServiceNameBattery == ""
+        and dbusServiceName.startswith("com.victronenergy.battery")
+    ) or (
+        dbusServiceNameBattery != "" and dbusServiceName == dbusServiceNameBattery
+    ):
+        return "battery"
+
+    if (
+        dbusServiceNameGrid == ""
+        and dbusServiceName.startswith("com.victronenergy.grid")
+    ) or (dbusServiceNameGrid != "" and dbusServiceName == dbusServiceNameGrid):
+        return "grid"
+
+    return None
+
+
+class Aggregate:
+    """
+    Combines the values of one path of several services, see aggregation_modes.
+
+    The running sums are updated from the previous and the new value of a service, so a change
+    costs the same for any number of services. Values that are not numbers are left out of the
+    sums. A weighted mean falls back to the mean while no service has a weight above zero.
+    The running sums pick up rounding errors, e.g. a + b - a is not exactly b, so the results
+    are rounded to decimals and the sums are built again from the values every rebuild_interval
+    changes.
+    """
+
+    __slots__ = (
+        "mode",
+        "default",
+        "value",
+        "_sources",
+        "_added",
+        "_first",
+        "_changes",
+        "_count",
+        "_sum",
+        "_weighted_sum",
+        "_weight_sum",
+    )
+
+    decimals = 6
+    rebuild_interval = 10000
+
+    def __init__(self, mode, default=None):
+        self.mode = mode
+        self.default = default
+        self.value = default
+        # value, weight and number of each service, numbered in the order the services were added
+        self._sources = {}
+        self._added = 0
+        # the first service that has a value, for the mode "first"
+        self._first = None
+        self._changes = 0
+        self._count = 0
+        self._sum = 0
+        self._weighted_sum = 0
+        self._weight_sum = 0
+
+    def set_value(self, source, value):
+        entry = self._sources.get(source)
+        self._contribute(source, value, None if entry is None else entry[1], entry)
+
+    def set_weight(self, source, weight):
+        entry = self._sources.get(source)
+        self._contribute(source, None if entry is None else entry[0], weight, entry)
+
+    def remove(self, source):
+        entry = self._sources.pop(source, None)
+        if entry is None:
+            return
+        self._add(entry[0], entry[1], sign=-1)
+        if source == self._first:
+            self._find_first()
+        self._update()
+
+    def _contribute(self, source, value, weight, entry):
+        if entry is None:
+            number = self._added
+            self._added += 1
+        else:
+            number = entry[2]
+            self._add(entry[0], entry[1], sign=-1)
+        self._sources[source] = (value, weight, number)
+        self._add(value, weight, sign=1)
+
+        first = self._first
+        if value is not None:
+            if first is None or number < self._sources[first][2]:
+                self._first = source
+        elif source == first:
+            self._find_first()
+
+        self._changes += 1
+        if self._changes >= self.rebuild_interval:
+            self._rebuild()
+        self._update()
+
+    def _find_first(self):
+        # only needed when the first service loses its value or is removed
+        self._first = next((source for source, entry in self._sources.items() if entry[0] is not None), None)
+
+    def _rebuild(self):
+        self._changes = 0
+        self._count = 0
+        self._sum = self._weighted_sum = self._weight_sum = 0
+        for value, weight, number in self._sources.values():
+            self._add(value, weight, sign=1)
+
+    def _add(self, value, weight, sign):
+        if not isinstance(value, (int, float)):
+            return
+        self._count += sign
+        self._sum += sign * value
+        if isinstance(weight, (int, float)) and weight > 0:
+            self._weighted_sum += sign * value * weight
+            self._weight_sum += sign * weight
+
+    def _update(self):
+        mode = self.mode
+        if mode == "first":
+            value = None if self._first is None else self._sources[self._first][0]
+        elif self._count == 0:
+            # start again from exact zeros instead of the rounding errors of the running sums
+            self._sum = self._weighted_sum = self._weight_sum = 0
+            value = None
+        elif mode == "sum":
+            value = round(self._sum, self.decimals)
+        elif mode == "mean" or self._weight_sum <= 0:
+            value = round(self._sum / self._count, self.decimals)
+        else:
+            value = round(self._weighted_sum / self._weight_sum, self.decimals)
+        self.value = self.default if value is None else value
+
+
+class InputRoute:
+    """
+    How the changes of one monitored service are handled, decided once when the service is added
+    instead of for every change. kind is "battery", "grid" or None if the changes are not used.
+    handlers are the functions called with the service name and the new value by path, see
+    create_aggregated_input_values. Values read from a single service are already stored by the
+    DbusMonitor, see EmulatorHost._bind_inputs, and have no handlers.
+    """
+
+    __slots__ = ("servicename", "kind", "handlers", "sample_paths", "changes")
+
+    def __init__(self, servicename):
+        self.servicename = servicename
+        self.kind = None
+        self.handlers = {}
+        # changes of these paths change the energy
+        self.sample_paths = frozenset()
+        # number of changes received, kept when the service disappears
+        self.changes = 0
+
+    def set_kind(self, kind, handlers):
+        self.kind = kind
+        self.handlers = handlers
+        self.sample_paths = input_sample_paths.get(kind, frozenset())
+
+
+class VebusValues:
+    """
+    Derives the values of an emulated VE.Bus device from the grid and battery values.
+
+    Does not use D-Bus, so it is used by the emulated devices as well as to replay recorded traces.
+    The grid and battery values are given as dicts of BoundValues or Aggregates by path, which are
+    kept up to date by the DbusMonitor, the EmulatorHost or the replay. The derived values are written to fixed slots of values, plan
+    maps each path to its slot.
+    """
+
+    def __init__(self, phases, energy=None):
+        self.phases = phases
+
+        # energy counters, continued from the given values
+        self.energy = load_energy_counters(energy or {})
+
+        plan = []
+        phase_inputs = []
+        for number, phase in enumerate(phases):
+            slot = SLOT_PHASES + number * 3
+            phase_inputs.append((slot, f"/Ac/{phase}/Power", f"/Ac/{phase}/Voltage"))
+
+            # Ac out is always the same as the grid as we do not have an AC in PV inverter
+            # or any battery which could be inverted to AC
+            for prefix in (f"/Ac/ActiveIn/{phase}", f"/Ac/Out/{phase}"):
+                plan.append((prefix + "/I", slot))
+                plan.append((prefix + "/P", slot + 1))
+                plan.append((prefix + "/S", slot + 1))
+                plan.append((prefix + "/V", slot + 2))
+
+        # Overall values
+        for path in ("/Ac/ActiveIn/P", "/Ac/ActiveIn/S", "/Ac/Out/P", "/Ac/Out/S"):
+            plan.append((path, SLOT_AC_POWER))
+
+        plan.append(("/BatteryOperationalLimits/MaxChargeCurrent", SLOT_MAX_CHARGE_CURRENT))
+        plan.append(("/BatteryOperationalLimits/MaxChargeVoltage", SLOT_MAX_CHARGE_VOLTAGE))
+        plan.append(("/BatteryOperationalLimits/MaxDischargeCurrent", SLOT_MAX_DISCHARGE_CURRENT))
+
+        # get values from BMS
+        # for bubble flow in GUI
+        plan.append(("/Dc/0/Current", SLOT_DC_CURRENT))
+        plan.append(("/Dc/0/MaxChargeCurrent", SLOT_MAX_CHARGE_CURRENT))
+        plan.append(("/Dc/0/Power", SLOT_DC_POWER))
+        plan.append(("/Dc/0/Temperature", SLOT_DC_TEMPERATURE))
+        plan.append(("/Dc/0/Voltage", SLOT_DC_VOLTAGE))
+
+        plan.append(("/Leds/Absorption", SLOT_LED_ABSORPTION))
+        plan.append(("/Leds/Bulk", SLOT_LED_BULK))
+        plan.append(("/Leds/Float", SLOT_LED_FLOAT))
+
+        plan.append(("/Soc", SLOT_SOC))
+
+        for index, direction in enumerate(energy_directions):
+            plan.append(("/Energy/" + direction, SLOT_ENERGY + index))
+
+        self.plan = tuple(plan)
+        self._phase_inputs = tuple(phase_inputs)
+        self.values = [None] * (SLOT_PHASES + 3 * len(phases))
+
+    def grid_power(self, grid):
+        power = 0
+        for slot, power_path, voltage_path in self._phase_inputs:
+            power += grid[power_path].value or 0
+        return power
+
+    def sample_energy(self, grid, battery_power, now=None):
+        self.energy.sample(self.grid_power(grid), battery_power, now)
+
+    def compute(self, grid, battery):
+        values = self.values
+
+        ac_power = 0
+        for slot, power_path, voltage_path in self._phase_inputs:
+            power = grid[power_path].value
+            # an unknown voltage is published as invalid and no current is derived from it
+            voltage = grid[voltage_path].value
+            if power is None or voltage is None:
+                values[slot] = None
+            else:
+                values[slot] = round(power / voltage, 2) if voltage > 0 else 0
+            if power is not None:
+                ac_power += power
+            values[slot + 1] = power
+            values[slot + 2] = voltage
+        values[SLOT_AC_POWER] = ac_power
+
+        values[SLOT_MAX_CHARGE_CURRENT] = battery["/Info/MaxChargeCurrent"].value
+        values[SLOT_MAX_CHARGE_VOLTAGE] = battery["/Info/MaxChargeVoltage"].value
+        values[SLOT_MAX_DISCHARGE_CURRENT] = battery["/Info/MaxDischargeCurrent"].value
+
+        dc_current = battery["/Dc/0/Current"].value
+        dc_power = battery["/Dc/0/Power"].value
+        dc_voltage = battery["/Dc/0/Voltage"].value
+        if dc_voltage is None and dc_power is not None and dc_current:
+            dc_voltage = round(dc_power / dc_current, 2)
+        values[SLOT_DC_CURRENT] = dc_current
+        values[SLOT_DC_POWER] = dc_power
+        values[SLOT_DC_TEMPERATURE] = battery["/Dc/0/Temperature"].value
+        values[SLOT_DC_VOLTAGE] = dc_voltage
+
+        charge_mode = battery["/Info/ChargeMode"].value or ""
+        values[SLOT_LED_ABSORPTION] = 1 if charge_mode.startswith("Absorption") else 0
+        values[SLOT_LED_BULK] = 1 if charge_mode.startswith("Bulk") else 0
+        values[SLOT_LED_FLOAT] = 1 if charge_mode.startswith("Float") else 0
+
+        values[SLOT_SOC] = battery["/Soc"].value
+
+        slot = SLOT_ENERGY
+        for kwh in self.energy.kwh:
+            values[slot] = round(kwh, 3)
+            slot += 1
+
+
+class PerfWindow:
+    """
+    Aggregates the cost of the ticks of one device over perf_window seconds.
+
+    The aggregates are published once per window together with the other changes of a tick,
+    so the counters do not add signals of their own.
+    """
+
+    paths = (
+        "/Mgmt/Perf/TickUs",
+        "/Mgmt/Perf/MaxTickUs",
+        "/Mgmt/Perf/CpuUs",
+        "/Mgmt/Perf/PathsWritten",
+        "/Mgmt/Perf/PathsChanged",
+        "/Mgmt/Perf/SignalsPerTick",
+    )
+
+    def __init__(self, window):
+        self.window = window
+        self._start = monotonic()
+        self._reset()
+
+    def _reset(self):
+        self._ticks = 0
+        self._wall = 0
+        self._wall_max = 0
+        self._cpu = 0
+        self._written = 0
+        self._changed = 0
+        self._signals = 0
+
+    def add(self, wall, cpu, written, changed, signals):
+        self._ticks += 1
+        self._wall += wall
+        if wall > self._wall_max:
+            self._wall_max = wall
+        self._cpu += cpu
+        self._written += written
+        self._changed += changed
+        self._signals += signals
+
+    def due(self):
+        return self._ticks > 0 and monotonic() - self._start >= self.window
+
+    def publish(self, dbusservice):
+        ticks = self._ticks
+        dbusservice["/Mgmt/Perf/TickUs"] = round(self._wall / ticks * 1e6)
+        dbusservice["/Mgmt/Perf/MaxTickUs"] = round(self._wall_max * 1e6)
+        dbusservice["/Mgmt/Perf/CpuUs"] = round(self._cpu / ticks * 1e6)
+        dbusservice["/Mgmt/Perf/PathsWritten"] = round(self._written / ticks, 1)
+        dbusservice["/Mgmt/Perf/PathsChanged"] = round(self._changed / ticks, 1)
+        dbusservice["/Mgmt/Perf/SignalsPerTick"] = round(self._signals / ticks, 2)
+        self._start = monotonic()
+        self._reset()
 
 
 class DbusMultiPlusEmulator:
+    """One emulated VE.Bus device, which publishes the values of its phases from the shared inputs of the host."""
+
     def __init__(
         self,
+        host,
         servicename,
         deviceinstance,
         paths,
+        phases=phases,
+        energy=None,
+        bus=None,
         productname="MultiPlus-II xx/5000/xx-xx (emulated)",
         connection="VE.Bus",
     ):
-        self._dbusservice = VeDbusService(servicename)
+        self._host = host
+        self._dbusservice = VeDbusService(servicename, bus=bus)
         self._paths = paths
+        self.servicename = servicename
+        self.phases = phases
+
+        # count the D-Bus signals saved by batching all changes of a tick into one ItemsChanged signal
+        self._signals_saved = 0
+        # count the ItemsChanged signals sent by update
+        self.signals_sent = 0
+
+        # values derived from the grid and battery values, energy counters continued from the last saved values
+        self._derived = VebusValues(phases, energy)
 
         logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
 
@@ -112,6 +1056,20 @@ class DbusMultiPlusEmulator:
             "Unkown version, and running on Python " + platform.python_version(),
         )  # ok
         self._dbusservice.add_path("/Mgmt/Connection", connection)  # ok
+        self._dbusservice.add_path("/Mgmt/Perf/SignalsSaved", 0)
+        self._dbusservice.add_path(
+            "/Mgmt/Perf/UpdateRate",
+            None,
+            gettextcallback=lambda p, v: str("%.1f" % v) + "Hz",
+        )
+        # cost of the ticks, averaged over perf_window seconds
+        self._perf = PerfWindow(perf_window)
+        for path in PerfWindow.paths:
+            self._dbusservice.add_path(
+                path,
+                None,
+                gettextcallback=(lambda p, v: str(v) + "us") if path.endswith("Us") else None,
+            )
 
         # Create the mandatory objects
         self._dbusservice.add_path("/DeviceInstance", deviceinstance)  # ok
@@ -127,7 +1085,23 @@ class DbusMultiPlusEmulator:
         # self._dbusservice.add_path('/Position', 0)
         # self._dbusservice.add_path('/StatusCode', 0)
 
-        for path, settings in self._paths.items():
+        # only the paths of a valid device and the derived paths are added now, the host adds
+        # the remaining paths with add_pending_paths once the main loop runs
+        self._pending_paths = dict(self._paths)
+        self._add_paths(startup_paths)
+
+        # static values are published once here, update only touches the paths
+        # that are derived from the grid and battery values
+        self._publish_static(self._dbusservice)
+        self._compile_publish_plan()
+
+    def _add_paths(self, paths, changes=None):
+        # adds the given paths that are not added yet, changes collects their values for
+        # clients that scanned the service before
+        for path in paths:
+            settings = self._pending_paths.pop(path, None)
+            if settings is None:
+                continue
             self._dbusservice.add_path(
                 path,
                 settings["initial"],
@@ -135,6 +1109,178 @@ class DbusMultiPlusEmulator:
                 writeable=True,
                 onchangecallback=self._handlechangedvalue,
             )
+            if changes is not None:
+                changes[path] = {
+                    "Value": wrap_dbus_value(settings["initial"]),
+                    "Text": self._dbusservice._dbusobjects[path].GetText(),
+                }
+
+    def add_pending_paths(self, count):
+        # adds up to count of the remaining paths and announces them in one ItemsChanged signal,
+        # returns if paths are left
+        with self._dbusservice as dbusservice:
+            self._add_paths(list(islice(self._pending_paths, count)), dbusservice.changes)
+        return bool(self._pending_paths)
+
+    def _publish_static(self, dbusservice):
+        # values that depend on the configuration, but not on the grid or battery values
+        values = {"/Ac/NumberOfPhases": len(self.phases)}
+        for phase in self.phases:
+            values[f"/Ac/ActiveIn/{phase}/F"] = grid_frequency
+            values[f"/Ac/Out/{phase}/F"] = grid_frequency
+            values[f"/Ac/Out/{phase}/NominalInverterPower"] = 4500
+
+        self._add_paths(values)
+        for path, value in values.items():
+            dbusservice[path] = value
+
+    def publish_static(self):
+        with self._dbusservice as dbusservice:
+            self._publish_static(dbusservice)
+
+    def set_phases(self, phases):
+        # the service and its paths stay registered, only the derivation and the publish plan
+        # are rebuilt and the paths of the removed phases are invalidated
+        removed = tuple(
+            prefix
+            for phase in self.phases
+            if phase not in phases
+            for prefix in (f"/Ac/ActiveIn/{phase}/", f"/Ac/Out/{phase}/")
+        )
+        derived = VebusValues(phases)
+        derived.energy = self._derived.energy
+        self._derived = derived
+        self.phases = phases
+
+        with self._dbusservice as dbusservice:
+            for path in self._paths:
+                if path.startswith(removed) and path not in self._pending_paths:
+                    dbusservice[path] = None
+            self._publish_static(dbusservice)
+        self._compile_publish_plan()
+
+    def _compile_publish_plan(self):
+        # resolve every derived path once to its export item, so that a tick
+        # does not need to format paths or to look them up
+        self._add_paths([path for path, slot in self._derived.plan])
+        self._publish_plan = tuple(
+            (path, self._dbusservice._dbusobjects[path], slot) for path, slot in self._derived.plan
+        )
+
+    def set_perf_window(self, window):
+        self._perf.window = window
+
+    def grid_power(self):
+        return self._derived.grid_power(self._host.gridValues)
+
+    def sample_energy(self, battery_power):
+        self._derived.sample_energy(self._host.gridValues, battery_power)
+
+    def energy_data(self):
+        return self._derived.energy.as_dict()
+
+    def _publish_derived(self, changes):
+        # computes the derived values and sets them by the publish plan, the changed values are
+        # collected in changes. Returns the number of changes
+        self._derived.compute(self._host.gridValues, self._host.batteryValues)
+
+        values = self._derived.values
+        for path, item, slot in self._publish_plan:
+            change = item._local_set_value(values[slot])
+            if change is not None:
+                changes[path] = change
+        return len(changes)
+
+    def update(self):
+        start = perf_counter()
+        cpu_start = thread_time()
+
+        # collect the changes of the whole tick and emit them as one ItemsChanged signal
+        # instead of one PropertiesChanged signal per path
+        with self._dbusservice as dbusservice:
+            changed = self._publish_derived(dbusservice.changes)
+
+            # increment UpdateIndex - to show that new data is available
+            index = dbusservice["/UpdateIndex"] + 1  # increment index
+            if index > 255:  # maximum value of the index
+                index = 0  # overflow from 255 to 0
+            dbusservice["/UpdateIndex"] = index
+
+            dbusservice["/Mgmt/Perf/UpdateRate"] = 1000 / self._host.update_interval
+
+            # every changed path would have been a separate signal without batching, one signal is
+            # still sent, the change of SignalsSaved itself is not counted
+            saved = len(dbusservice.changes) - 1
+            if saved > 0:
+                self._signals_saved += saved
+                dbusservice["/Mgmt/Perf/SignalsSaved"] = self._signals_saved
+
+            # the counters of the last window are sent with the changes of this tick
+            if self._perf.due():
+                self._perf.publish(dbusservice)
+
+            signals = 1 if dbusservice.changes else 0
+            self.signals_sent += signals
+
+        # the tick includes sending the signal when leaving the context
+        self._perf.add(
+            perf_counter() - start,
+            thread_time() - cpu_start,
+            len(self._publish_plan),
+            changed,
+            signals,
+        )
+
+    def _handlechangedvalue(self, path, value):
+        logging.debug("someone else updated %s to %s" % (path, value))
+        return True  # accept the change
+
+
+# upper bounds in seconds of the buckets of the update duration histogram
+tick_seconds_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+class Histogram:
+    """Counts observations in buckets with the given upper bounds, like a Prometheus histogram."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is for observations above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class EmulatorHost:
+    """
+    Hosts one or more emulated VE.Bus devices in one process.
+
+    All devices share one DbusMonitor with its grid and battery values, one update scheduler
+    and one energy storage, so an additional device only adds its own D-Bus service.
+    """
+
+    def __init__(self, units, paths, recorder=None):
+        # optional TraceRecorder for the received grid and battery changes
+        self._recorder = recorder
+
+        # duration of the updates, e.g. for the MetricsExporter
+        self.tick_seconds = Histogram(tick_seconds_buckets)
+
+        # InputRoute by service name of every monitored service that was ever seen
+        self._input_routes = {}
+
+        # monotonic timestamp of the last update and id of the scheduled recompute, if any
+        self._last_update = 0
+        self._recompute_id = None
+
+        # current interval of the update timer and the power at the last timer update
+        self.update_interval = update_interval_fast
+        self._last_power = None
 
         # ### read values from battery
         # Why this dummy? Because DbusMonitor expects these values to be there, even though we don't
@@ -166,19 +1312,6 @@ class DbusMultiPlusEmulator:
                 }
             }
         )
-        # create empty dictionary will be updated later
-        self.batteryValues = {
-            "/Dc/0/Current": None,
-            "/Dc/0/Power": None,
-            "/Dc/0/Temperature": None,
-            "/Dc/0/Voltage": None,
-            "/Soc": None,
-            "/Info/ChargeMode": "",
-            "/Info/MaxChargeCurrent": None,
-            "/Info/MaxChargeVoltage": None,
-            "/Info/MaxDischargeCurrent": None,
-        }
-
         dbus_tree.update(
             {
                 "com.victronenergy.grid": {
@@ -203,24 +1336,19 @@ class DbusMultiPlusEmulator:
                 }
             }
         )
-       
-
-        # create empty dictionary will be updated later
-        self.gridValues = {
-            "/Ac/L1/Power": None,
-            "/Ac/L2/Power": None,
-            "/Ac/L3/Power": None,
-            "/Ac/L1/Current": None,
-            "/Ac/L2/Current": None,
-            "/Ac/L3/Current": None,
-            "/Ac/L1/Voltage": None,
-            "/Ac/L2/Voltage": None,
-            "/Ac/L3/Voltage": None,
-            # ---
-            "/Ac/Power": None,
-            "/Ac/Current": None,
-            "/Ac/Voltage": None,
-        }
+
+        # the weights of weighted values, like the capacity of the batteries
+        for kind in ("battery", "grid"):
+            for path in get_weight_paths(kind):
+                dbus_tree["com.victronenergy." + kind].setdefault(path, dummy)
+
+        # the values are read from the DbusMonitor once it is started, see _bind_inputs
+        self.gridValues, self.batteryValues = create_unbound_input_values()
+        # handlers of the changes by path and the Aggregates of each kind, if its values are combined
+        self._input_handlers = {"battery": {}, "grid": {}}
+        self._aggregates = {"battery": (), "grid": ()}
+        # number of routed services of each kind
+        self._routed_count = {"battery": 0, "grid": 0}
 
         """
         dbus_tree.update({
@@ -241,298 +1369,724 @@ class DbusMultiPlusEmulator:
         })
         """
 
+        # energy counters of all devices, continued from the last saved values
+        self._energy_storage = EnergyStorage(
+            data_watt_hours_working_file,
+            data_watt_hours_storage_file,
+            data_watt_hours_journal_file,
+        )
+        energy_data = self._energy_storage.load()
+        startup_profile.mark("energy counters loaded")
+
+        self.units = []
+        for number, unit in enumerate(units):
+            # the energy was saved for a single device before more devices could be emulated
+            if "units" in energy_data:
+                energy = energy_data["units"].get(unit["servicename"])
+            elif number == 0:
+                energy = energy_data
+            else:
+                energy = None
+
+            self.units.append(
+                DbusMultiPlusEmulator(
+                    self,
+                    servicename=unit["servicename"],
+                    deviceinstance=unit["deviceinstance"],
+                    paths=paths,
+                    phases=unit.get("phases", phases),
+                    energy=energy,
+                    # the object paths of each service need their own connection
+                    bus=None if number == 0 else self._private_bus(),
+                )
+            )
+
+        self._update_grid_power_paths()
+        startup_profile.mark("devices registered")
+
+        # the grid and battery services are scanned once the main loop runs, so the devices
+        # are on D-Bus before
+        self._dbus_tree = dbus_tree
+        self._dbusmonitor = None
+        GLib.idle_add(self._start_dbus_monitor)
+
+        GLib.timeout_add(self.update_interval, self._on_timer)
+        self._save_timers = []
+        self._start_save_timers()
+        if self._recorder is not None:
+            GLib.timeout_add_seconds(record_flush_interval, self._recorder.flush)
+
+    def _update_grid_power_paths(self):
+        # grid power paths of all phases used by any device
+        self._grid_power_paths = tuple(
+            sorted({f"/Ac/{phase}/Power" for unit in self.units for phase in unit.phases})
+        )
+
+    def _start_save_timers(self):
+        for timer_id in self._save_timers:
+            GLib.source_remove(timer_id)
+        self._save_timers = [
+            GLib.timeout_add_seconds(
+                data_watt_hours_timespan,
+                self._save_energy,
+                self._energy_storage.save_working,
+            ),
+            GLib.timeout_add_seconds(
+                data_watt_hours_save,
+                self._save_energy,
+                self._energy_storage.save_storage,
+            ),
+        ]
+
+    def reconfigure(self, old, new):
+        # applies a changed configuration, the globals are already updated
+        changed = {name for name in new if new[name] != old[name]}
+        if not changed:
+            return
+        logging.info("Applying changed configuration: %s" % ", ".join(sorted(changed)))
+
+        if "units" in changed:
+            old_units = {unit["servicename"]: unit["deviceinstance"] for unit in old["units"]}
+            new_units = {unit["servicename"]: unit["deviceinstance"] for unit in new["units"]}
+            if old_units != new_units:
+                logging.warning("Adding, removing or renumbering VE.Bus devices needs a restart of the driver")
+
+            phases_by_name = {unit["servicename"]: unit["phases"] for unit in new["units"]}
+            for unit in self.units:
+                unit_phases = phases_by_name.get(unit.servicename)
+                if unit_phases is not None and unit_phases != unit.phases:
+                    unit.set_phases(unit_phases)
+            self._update_grid_power_paths()
+
+        if "grid_frequency" in changed:
+            for unit in self.units:
+                unit.publish_static()
+
+        # a different grid meter or battery is read from the values the DbusMonitor already has
+        if "dbusServiceNameBattery" in changed:
+            self._bind_inputs("battery", self.batteryValues)
+        if "dbusServiceNameGrid" in changed:
+            self._bind_inputs("grid", self.gridValues)
+        if "dbusServiceNameBattery" in changed or "dbusServiceNameGrid" in changed:
+            self._route_inputs()
+
+        if "perf_window" in changed:
+            for unit in self.units:
+                unit.set_perf_window(perf_window)
+
+        for name in ("working_file", "storage_file", "journal_file"):
+            setattr(self._energy_storage, name, new["data_watt_hours_" + name])
+        if "data_watt_hours_timespan" in changed or "data_watt_hours_save" in changed:
+            self._start_save_timers()
+
+        if "metrics_address" in changed:
+            logging.warning("Changing metrics_address needs a restart of the driver")
+
+        if "aggregation_modes" in changed:
+            logging.warning("Changing the AGGREGATION section needs a restart of the driver")
+
+        self._schedule_recompute()
+
+    def _bind_inputs(self, kind, values):
+        # read the values directly from the DbusMonitor if a service is configured or only one service
+        # of the kind is routed, else combine the values of all services of the kind, the routes pass
+        # their changes to the aggregates
+        if self._dbusmonitor is None:
+            return
+        service = dbusServiceNameBattery if kind == "battery" else dbusServiceNameGrid
+        if service == "":
+            routes = [route for route in self._input_routes.values() if route.kind == kind]
+            if len(routes) != 1:
+                aggregated, self._input_handlers[kind] = create_aggregated_input_values(kind)
+                self._aggregates[kind] = tuple(aggregated.values())
+                values.update(aggregated)
+                # the new aggregates start with the current values of the routed services
+                for route in routes:
+                    self._set_route_kind(route, kind)
+                logging.info("Combining the %s values of all com.victronenergy.%s services" % (kind, kind))
+                return
+            service = routes[0].servicename
+            routes[0].set_kind(kind, {})
+
+        self._input_handlers[kind] = {}
+        self._aggregates[kind] = ()
+        defaults = create_input_values()[0 if kind == "grid" else 1]
+        for path, default in defaults.items():
+            values[path] = self._dbusmonitor.bind_value(service, path, default)
+        logging.info("Reading the %s values from %s" % (kind, service))
+
+    @staticmethod
+    def _private_bus():
+        return (
+            dbus.SessionBus(private=True)
+            if "DBUS_SESSION_BUS_ADDRESS" in os.environ
+            else dbus.SystemBus(private=True)
+        )
+
+    def _create_dbus_monitor(self, *args, **kwargs):
+        return DbusMonitor(*args, **kwargs)
+
+    def _start_dbus_monitor(self):
         # self._dbusreadservice = DbusMonitor('com.victronenergy.battery.zero')
+        # all services are scanned at once with asynchronous calls, _inputs_scanned is called when done
         self._dbusmonitor = self._create_dbus_monitor(
-            dbus_tree,
-            valueChangedCallback=self._dbus_value_changed,
+            self._dbus_tree,
+            valuesChangedCallback=self._dbus_values_changed,
             deviceAddedCallback=self._device_added,
             deviceRemovedCallback=self._device_removed,
+            asyncScan=True,
+            scanFinishedCallback=self._inputs_scanned,
+            scopedSignals=monitor_scoped_signals,
         )
+        self._bind_inputs("battery", self.batteryValues)
+        self._bind_inputs("grid", self.gridValues)
+        startup_profile.mark("bus names listed")
+        return False
+
+    def _inputs_scanned(self):
+        startup_profile.mark("grid and battery scanned")
+        self._route_inputs()
+
+        # publish the scanned values right away instead of waiting for their next change
+        self._update()
+        startup_profile.mark("first valid data")
+
+        GLib.idle_add(self._add_pending_paths, priority=GLib.PRIORITY_LOW)
+        return False
+
+    def _add_pending_paths(self):
+        pending = False
+        for unit in self.units:
+            if unit.add_pending_paths(startup_paths_per_idle):
+                pending = True
+        if pending:
+            return True
 
-        GLib.timeout_add(1000, self._update)  # pause 1000ms before the next request
+        startup_profile.mark("remaining paths added")
+        startup_profile.report()
+        return False
+
+    @property
+    def input_changes(self):
+        # received changes per service, e.g. for the MetricsExporter
+        return {route.servicename: route.changes for route in self._input_routes.values() if route.changes}
+
+    def _route_inputs(self):
+        # decide again for all services of the DbusMonitor, e.g. after the grid or battery service changed
+        if self._dbusmonitor is None:
+            return
+        for route in self._input_routes.values():
+            self._set_route_kind(route, None)
+        for service, instance in self._dbusmonitor.get_service_list().items():
+            self._device_added(service, instance)
+
+    def _record_route(self, route, kind, current):
+        # records the values of all paths of the kind, the current values of the service when it is
+        # routed to the kind or None when it is not any more, so a replay starts from the same values
+        paths = list(create_input_values()[0 if kind == "grid" else 1]) + get_weight_paths(kind)
+        for path in paths:
+            value = self._dbusmonitor.get_value(route.servicename, path) if current else None
+            self._recorder.record(route.servicename, path, value)
+
+    def _set_route_kind(self, route, kind):
+        # the combined values of the previous kind no longer contain the service
+        previous_kind = route.kind
+        for aggregate in self._aggregates.get(previous_kind, ()):
+            aggregate.remove(route.servicename)
+
+        if self._recorder is not None and previous_kind != kind:
+            if previous_kind is not None:
+                self._record_route(route, previous_kind, current=False)
+            if kind is not None:
+                self._record_route(route, kind, current=True)
+
+        route.set_kind(kind, self._input_handlers.get(kind, {}))
+
+        # and those of the new kind start with its current values
+        for path, handlers in route.handlers.items():
+            value = self._dbusmonitor.get_value(route.servicename, path)
+            for handler in handlers:
+                handler(route.servicename, value)
+
+        # the values of a single service are read without combining them, which saves the handlers
+        # of each change, the values are bound again when a second service of the kind is routed
+        # or the single one goes away
+        if previous_kind == kind:
+            return
+        for changed_kind, step in ((previous_kind, -1), (kind, 1)):
+            if changed_kind is None:
+                continue
+            count = self._routed_count[changed_kind] + step
+            self._routed_count[changed_kind] = count
+            configured = dbusServiceNameBattery if changed_kind == "battery" else dbusServiceNameGrid
+            if configured == "" and (count == 1) != (count - step == 1):
+                self._bind_inputs(changed_kind, self.batteryValues if changed_kind == "battery" else self.gridValues)
+
+    def _dbus_values_changed(self, changes):
+        # all changes since the last main loop iteration, the values are already updated by the
+        # DbusMonitor, see _bind_inputs. The energy is sampled once for all of them
+        self._changed = True
+        routes = self._input_routes
+        recorder = self._recorder
+        inputs = False
+        sample = False
 
-    def _create_dbus_monitor(self, *args, **kwargs):
-        return DbusMonitor(*args, **kwargs)
+        for dbusServiceName, dbusPath, options, change, deviceInstance in changes:
+            route = routes.get(dbusServiceName)
+            if route is None or route.kind is None:
+                continue
 
-    def _dbus_value_changed(
-        self, dbusServiceName, dbusPath, dict, changes, deviceInstance
-    ):
-        self._changed = True
+            inputs = True
+            route.changes += 1
+            value = change["Value"]
 
-        if (
-            dbusServiceNameBattery == ""
-            and dbusServiceName.startswith("com.victronenergy.battery")
-        ) or (
-            dbusServiceNameBattery != "" and dbusServiceName == dbusServiceNameBattery
-        ):
-            self.batteryValues.update({str(dbusPath): changes["Value"]})
+            if recorder is not None:
+                recorder.record(route.servicename, dbusPath, value)
+
+            handlers = route.handlers.get(dbusPath)
+            if handlers is not None:
+                for handler in handlers:
+                    handler(route.servicename, value)
 
-        if (
-            dbusServiceNameGrid == ""
-            and dbusServiceName.startswith("com.victronenergy.grid")
-        ) or (dbusServiceNameGrid != "" and dbusServiceName == dbusServiceNameGrid):
-            self.gridValues.update({str(dbusPath): changes["Value"]})
-            
+            if dbusPath in route.sample_paths:
+                sample = True
+
+        if sample:
+            self._sample_energy()
+        if inputs:
+            self._schedule_recompute()
 
     def _device_added(self, service, instance, do_service_change=True):
+        route = self._input_routes.get(service)
+        if route is None:
+            route = self._input_routes[service] = InputRoute(str(service))
+        previous_kind = route.kind
+        self._set_route_kind(route, get_input_kind(service))
 
-        pass
+        # the combined or bound values include the service now
+        if previous_kind is not None or route.kind is not None:
+            self._schedule_recompute()
 
     def _device_removed(self, service, instance):
-    
-        pass
+        route = self._input_routes.get(service)
+        if route is not None and route.kind is not None:
+            self._set_route_kind(route, None)
+            self._schedule_recompute()
+
+    def _sample_energy(self):
+        # the battery is shared, so each device gets an equal part of its power
+        battery_power = (self.batteryValues["/Dc/0/Power"].value or 0) / len(self.units)
+        for unit in self.units:
+            unit.sample_energy(battery_power)
+
+    def _schedule_recompute(self):
+        # coalesce all changes within the debounce window into one update
+        if self._recompute_id is not None:
+            return
+        delay = update_min_interval - (monotonic() - self._last_update) * 1000
+        self._recompute_id = GLib.timeout_add(max(0, int(delay)), self._recompute)
+
+    def _recompute(self):
+        self._recompute_id = None
+        self._update()
+        return False
+
+    def _input_power(self):
+        grid_power = 0
+        for path in self._grid_power_paths:
+            grid_power += self.gridValues[path].value or 0
+        battery_power = self.batteryValues["/Dc/0/Power"].value or 0
+        return grid_power, battery_power
+
+    def _on_timer(self):
+        # tick fast while the power is changing and back off step by step while it is flat
+        power = self._input_power()
+        if self._last_power is not None and (
+            abs(power[0] - self._last_power[0]) > update_power_threshold
+            or abs(power[1] - self._last_power[1]) > update_power_threshold
+        ):
+            interval = update_interval_fast
+        else:
+            interval = min(self.update_interval * 2, update_interval_slow)
+        self._last_power = power
+
+        if interval == self.update_interval:
+            self._update()
+            return True
+
+        self.update_interval = interval
+        self._update()
+        GLib.timeout_add(interval, self._on_timer)
+        return False
 
     def _update(self):
+        self._last_update = monotonic()
+        start = perf_counter()
         try:
-            ac_in_power = {phase: self.gridValues.get(f"/Ac/{phase}/Power", 0) for phase in phases}
-            ac_in_voltage = {phase: self.gridValues.get(f"/Ac/{phase}/Voltage", 0) for phase in phases}
+            # sample also when the power does not change, since only changes are received
+            self._sample_energy()
 
-            # Ac out power is always the same as the grid power as we do not have an AC in PV inverter
-            # or any battery which could be inverted to AC
-            ac_out_power = {phase: ac_in_power[phase] for phase in phases}
-
-            ac_in = {}
-            for phase in phases:
-                ac_in[phase] = {
-                    "current": round(ac_in_power[phase] / ac_in_voltage[phase], 2) if ac_in_voltage[phase] > 0 else 0,
-                    "power": ac_in_power[phase],
-                    "voltage": ac_in_voltage[phase],
-                }
+            for unit in self.units:
+                unit.update()
 
-            ac_out = {}
-            for phase in phases:
-                ac_out[phase] = {
-                    "current": round(ac_out_power[phase] / ac_in_voltage[phase], 2) if ac_in_voltage[phase] > 0 else 0,
-                    "power": ac_out_power[phase],
-                    "voltage": ac_in_voltage[phase],
-                }
+            self.tick_seconds.observe(perf_counter() - start)
+            return True
 
-            try:
-                self._dbusservice["/Ac/ActiveIn/ActiveInput"] = 0
-                self._dbusservice["/Ac/ActiveIn/Connected"] = 1
-                self._dbusservice["/Ac/ActiveIn/CurrentLimit"] = 16
-                self._dbusservice["/Ac/ActiveIn/CurrentLimitIsAdjustable"] = 1
-                self._dbusservice["/Ac/NumberOfAcInputs"] = 1
-                self._dbusservice["/Ac/NumberOfPhases"] = 3
-                self._dbusservice["/Ac/Out/NominalInverterPower"] = 4500
-            except Exception as e:
-                logging.error("Error updating dbus values: %s" % str(e))
-
-            for phase in phases:
-                self._dbusservice[f"/Ac/ActiveIn/{phase}/F"] = grid_frequency
-                self._dbusservice[f"/Ac/ActiveIn/{phase}/I"] = ac_in[phase]["current"]
-                self._dbusservice[f"/Ac/ActiveIn/{phase}/P"] = ac_in[phase]["power"]
-                self._dbusservice[f"/Ac/ActiveIn/{phase}/S"] = ac_in[phase]["power"]
-                self._dbusservice[f"/Ac/ActiveIn/{phase}/V"] = ac_in[phase]["voltage"]
-
-                self._dbusservice[f"/Ac/Out/{phase}/F"] = grid_frequency
-                self._dbusservice[f"/Ac/Out/{phase}/I"] = ac_out[phase]["current"]
-                self._dbusservice[f"/Ac/Out/{phase}/NominalInverterPower"] = 4500
-                self._dbusservice[f"/Ac/Out/{phase}/P"] = ac_out[phase]["power"]
-                self._dbusservice[f"/Ac/Out/{phase}/S"] = ac_out[phase]["power"]
-                self._dbusservice[f"/Ac/Out/{phase}/V"] = ac_out[phase]["voltage"]
-
-            # Overall values
-            self._dbusservice["/Ac/ActiveIn/P"] = sum(ac_in_power.values())
-            self._dbusservice["/Ac/ActiveIn/S"] = sum(ac_in_power.values())
-            self._dbusservice["/Ac/Out/P"] = sum(ac_out_power.values())
-            self._dbusservice["/Ac/Out/S"] = sum(ac_out_power.values())
-
-            self._dbusservice["/Ac/PowerMeasurementType"] = 4
-            self._dbusservice["/Ac/State/IgnoreAcIn1"] = 0
-            self._dbusservice["/Ac/State/SplitPhaseL2Passthru"] = None
-
-            self._dbusservice["/Alarms/HighDcCurrent"] = 0
-            self._dbusservice["/Alarms/HighDcVoltage"] = 0
-            self._dbusservice["/Alarms/HighTemperature"] = 0
-            self._dbusservice["/Alarms/L1/HighTemperature"] = 0
-            self._dbusservice["/Alarms/L1/LowBattery"] = 0
-            self._dbusservice["/Alarms/L1/Overload"] = 0
-            self._dbusservice["/Alarms/L1/Ripple"] = 0
-            self._dbusservice["/Alarms/L2/HighTemperature"] = 0
-            self._dbusservice["/Alarms/L2/LowBattery"] = 0
-            self._dbusservice["/Alarms/L2/Overload"] = 0
-            self._dbusservice["/Alarms/L2/Ripple"] = 0
-            self._dbusservice["/Alarms/L3/HighTemperature"] = 0
-            self._dbusservice["/Alarms/L3/LowBattery"] = 0
-            self._dbusservice["/Alarms/L3/Overload"] = 0
-            self._dbusservice["/Alarms/L3/Ripple"] = 0
-            self._dbusservice["/Alarms/LowBattery"] = 0
-            self._dbusservice["/Alarms/Overload"] = 0
-            self._dbusservice["/Alarms/PhaseRotation"] = 0
-            self._dbusservice["/Alarms/Ripple"] = 0
-            self._dbusservice["/Alarms/TemperatureSensor"] = 0
-            self._dbusservice["/Alarms/VoltageSensor"] = 0
-
-            self._dbusservice["/BatteryOperationalLimits/BatteryLowVoltage"] = None
-            self._dbusservice[
-                "/BatteryOperationalLimits/MaxChargeCurrent"
-            ] = self.batteryValues["/Info/MaxChargeCurrent"]
-            self._dbusservice[
-                "/BatteryOperationalLimits/MaxChargeVoltage"
-            ] = self.batteryValues["/Info/MaxChargeVoltage"]
-            self._dbusservice[
-                "/BatteryOperationalLimits/MaxDischargeCurrent"
-            ] = self.batteryValues["/Info/MaxDischargeCurrent"]
-            self._dbusservice["/BatterySense/Temperature"] = None
-            self._dbusservice["/BatterySense/Voltage"] = None
-
-            self._dbusservice["/Bms/AllowToCharge"] = 1
-            self._dbusservice["/Bms/AllowToChargeRate"] = 0
-            self._dbusservice["/Bms/AllowToDischarge"] = 1
-            self._dbusservice["/Bms/BmsExpected"] = 0
-            self._dbusservice["/Bms/BmsType"] = 0
-            self._dbusservice["/Bms/Error"] = 0
-            self._dbusservice["/Bms/PreAlarm"] = None
-
-            # get values from BMS
-            # for bubble flow in GUI
-            self._dbusservice["/Dc/0/Current"] = self.batteryValues["/Dc/0/Current"]
-            self._dbusservice["/Dc/0/MaxChargeCurrent"] = self.batteryValues[
-                "/Info/MaxChargeCurrent"
-            ]
-            self._dbusservice["/Dc/0/Power"] = self.batteryValues["/Dc/0/Power"]
-            self._dbusservice["/Dc/0/Temperature"] = self.batteryValues["/Dc/0/Temperature"]
-            self._dbusservice["/Dc/0/Voltage"] = (
-                self.batteryValues["/Dc/0/Voltage"]
-                if self.batteryValues["/Dc/0/Voltage"] is not None
-                else round(
-                    self.batteryValues["/Dc/0/Power"] / self.batteryValues["/Dc/0/Current"],
-                    2,
-                )
-                if self.batteryValues["/Dc/0/Power"] is not None
-                and self.batteryValues["/Dc/0/Current"] is not None
-                else None
-            )
+        except Exception as e:
+            logging.error(f"Error in _update method: {str(e)}")
+            return True
 
-            self._dbusservice["/Devices/0/ExtendStatus/ChargeDisabledDueToLowTemp"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/ChargeIsDisabled"] = None
-            self._dbusservice["/Devices/0/ExtendStatus/GridRelayReport/Code"] = None
-            self._dbusservice["/Devices/0/ExtendStatus/GridRelayReport/Count"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/GridRelayReport/Reset"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/HighDcCurrent"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/HighDcVoltage"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/IgnoreAcIn1"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/MainsPllLocked"] = 1
-            self._dbusservice["/Devices/0/ExtendStatus/PcvPotmeterOnZero"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/PowerPackPreOverload"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/SocTooLowToInvert"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/SustainMode"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/SwitchoverInfo/Connecting"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/SwitchoverInfo/Delay"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/SwitchoverInfo/ErrorFlags"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/TemperatureHighForceBypass"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/VeBusNetworkQualityCounter"] = 0
-            self._dbusservice["/Devices/0/ExtendStatus/WaitingForRelayTest"] = 0
-
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/0/ErrorFlags"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/0/Time"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/1/ErrorFlags"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/1/Time"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/2/ErrorFlags"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/2/Time"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/3/ErrorFlags"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/3/Time"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/4/ErrorFlags"] = None
-            self._dbusservice["/Devices/0/InterfaceProtectionLog/4/Time"] = None
-
-            self._dbusservice["/Devices/0/SerialNumber"] = "HQ00000AA01"
-            self._dbusservice["/Devices/0/Version"] = 2623497
-
-            self._dbusservice["/Devices/Bms/Version"] = None
-            self._dbusservice["/Devices/Dmc/Version"] = None
-            self._dbusservice["/Devices/NumberOfMultis"] = 1
-
-            self._dbusservice["/Energy/InverterToAcOut"] = (
-                json_data["dc"]["discharging"]
-                if "dc" in json_data and "discharging" in json_data["dc"]
-                else 0
-            )
-            self._dbusservice["/Energy/OutToInverter"] = (
-                json_data["dc"]["charging"]
-                if "dc" in json_data and "charging" in json_data["dc"]
-                else 0
-            )
+    def _energy_data(self):
+        return {
+            "units": {unit.servicename: {"energy": unit.energy_data()} for unit in self.units},
+            "time": int(time()),
+        }
 
-            self._dbusservice["/FirmwareFeatures/BolFrame"] = 1
-            self._dbusservice["/FirmwareFeatures/BolUBatAndTBatSense"] = 1
-            self._dbusservice["/FirmwareFeatures/CommandWriteViaId"] = 1
-            self._dbusservice["/FirmwareFeatures/IBatSOCBroadcast"] = 1
-            self._dbusservice["/FirmwareFeatures/NewPanelFrame"] = 1
-            self._dbusservice["/FirmwareFeatures/SetChargeState"] = 1
-            self._dbusservice["/FirmwareSubVersion"] = 0
-
-            self._dbusservice["/Hub/ChargeVoltage"] = 55.2
-            self._dbusservice["/Hub4/AssistantId"] = 5
-            self._dbusservice["/Hub4/DisableCharge"] = 0
-            self._dbusservice["/Hub4/DisableFeedIn"] = 0
-            self._dbusservice["/Hub4/DoNotFeedInOvervoltage"] = 1
-            self._dbusservice["/Hub4/FixSolarOffsetTo100mV"] = 1
-            self._dbusservice["/Hub4/L1/AcPowerSetpoint"] = 0
-            self._dbusservice["/Hub4/L1/CurrentLimitedDueToHighTemp"] = 0
-            self._dbusservice["/Hub4/L1/FrequencyVariationOccurred"] = 0
-            self._dbusservice["/Hub4/L1/MaxFeedInPower"] = 32766
-            self._dbusservice["/Hub4/L1/OffsetAddedToVoltageSetpoint"] = 0
-            self._dbusservice["/Hub4/Sustain"] = 0
-            self._dbusservice["/Hub4/TargetPowerIsMaxFeedIn"] = 0
-
-            self._dbusservice["/Leds/Absorption"] = (
-                1 if self.batteryValues["/Info/ChargeMode"].startswith("Absorption") else 0
-            )
-            self._dbusservice["/Leds/Bulk"] = (
-                1 if self.batteryValues["/Info/ChargeMode"].startswith("Bulk") else 0
-            )
-            self._dbusservice["/Leds/Float"] = (
-                1 if self.batteryValues["/Info/ChargeMode"].startswith("Float") else 0
-            )
-            self._dbusservice["/Leds/Inverter"] = 1
-            self._dbusservice["/Leds/LowBattery"] = 0
-            self._dbusservice["/Leds/Mains"] = 1
-            self._dbusservice["/Leds/Overload"] = 0
-            self._dbusservice["/Leds/Temperature"] = 0
-
-            self._dbusservice["/Mode"] = 3
-            self._dbusservice["/ModeIsAdjustable"] = 1
-            self._dbusservice["/PvInverter/Disable"] = 0
-            self._dbusservice["/Quirks"] = 0
-            self._dbusservice["/RedetectSystem"] = 0
-            self._dbusservice["/Settings/Alarm/System/GridLost"] = 1
-            self._dbusservice["/Settings/SystemSetup/AcInput1"] = 1
-            self._dbusservice["/Settings/SystemSetup/AcInput2"] = 0
-            self._dbusservice["/ShortIds"] = 1
-            self._dbusservice["/Soc"] = self.batteryValues["/Soc"]
-            self._dbusservice["/State"] = 8
-            self._dbusservice["/SystemReset"] = None
-            self._dbusservice["/VebusChargeState"] = 1
-            self._dbusservice["/VebusError"] = 0
-            self._dbusservice["/VebusMainState"] = 9
+    def _save_energy(self, save):
+        save(self._energy_data())
+        return True
+
+    def shutdown(self):
+        # save the energy counters to the persistent storage before exiting
+        self._energy_storage.save_working(self._energy_data())
+        self._energy_storage.save_storage(self._energy_data())
+        self._energy_storage.close()
+        if self._recorder is not None:
+            self._recorder.flush()
+
+
+class MetricsExporter:
+    """
+    Serves the metrics of the host as OpenMetrics text over HTTP on a TCP or unix socket.
+
+    The response is kept as preformatted buffer and reused for max_age seconds, so scrapes
+    in short succession hardly cost any CPU. The sockets are non-blocking and served from
+    the GLib main loop: a request is read and the response written in as many steps as the
+    client needs, so a slow client never delays the updates.
+    """
+
+    content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+    # seconds a rendered response is reused for
+    max_age = 1
+    # seconds after which a client that did not finish its request and response is disconnected
+    client_timeout = 5
+    # bytes of a request that are read at most, the request is not needed
+    request_limit = 4096
+
+    def __init__(self, host, address):
+        self._host = host
+        self.address = address
+        self._response = None
+        self._rendered = 0
+        # client socket -> [request or remaining response, io watch id, timeout id]
+        self._clients = {}
+
+        # the labels of each device are formatted once
+        self._units = [('service="%s"' % unit.servicename, unit) for unit in host.units]
+
+        if address.startswith("/"):
+            if os.path.exists(address):
+                os.remove(address)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.bind(address)
+        else:
+            hostname, _, port = address.rpartition(":")
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket.bind((hostname or "127.0.0.1", int(port)))
+        self._socket.listen(4)
+        self._socket.setblocking(False)
+        self._watch_id = GLib.io_add_watch(self._socket.fileno(), GLib.IO_IN, self._accept)
+        logging.info("Serving metrics on %s" % address)
+
+    def close(self):
+        GLib.source_remove(self._watch_id)
+        for client in list(self._clients):
+            self._disconnect(client)
+        self._socket.close()
+        if self.address.startswith("/") and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _accept(self, fd, condition):
+        try:
+            client, _ = self._socket.accept()
+        except BlockingIOError:
+            return True
 
-            # increment UpdateIndex - to show that new data is available
-            index = self._dbusservice["/UpdateIndex"] + 1  # increment index
-            if index > 255:  # maximum value of the index
-                index = 0  # overflow from 255 to 0
-            self._dbusservice["/UpdateIndex"] = index
+        client.setblocking(False)
+        self._clients[client] = [
+            b"",
+            GLib.io_add_watch(client.fileno(), GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._read, client),
+            GLib.timeout_add_seconds(self.client_timeout, self._timeout, client),
+        ]
+        return True
 
+    def _read(self, fd, condition, client):
+        state = self._clients[client]
+        try:
+            data = client.recv(1024)
+        except BlockingIOError:
             return True
+        except OSError as e:
+            logging.debug("Error reading metrics request: %s" % str(e))
+            self._disconnect(client, watch=False)
+            return False
 
-        except Exception as e:
-            logging.error(f"Error in _update method: {str(e)}")
+        state[0] += data
+        if data and b"\r\n\r\n" not in state[0] and len(state[0]) < self.request_limit:
             return True
 
+        # the request is complete, or the client only closed its side of the connection
+        state[0] = self._get_response()
+        state[1] = GLib.io_add_watch(client.fileno(), GLib.IO_OUT | GLib.IO_HUP | GLib.IO_ERR, self._write, client)
+        return False
 
-    def _handlechangedvalue(self, path, value):
-        logging.debug("someone else updated %s to %s" % (path, value))
-        return True  # accept the change
+    def _write(self, fd, condition, client):
+        state = self._clients[client]
+        try:
+            sent = client.send(state[0])
+        except BlockingIOError:
+            return True
+        except OSError as e:
+            logging.debug("Error writing metrics response: %s" % str(e))
+            self._disconnect(client, watch=False)
+            return False
 
+        state[0] = state[0][sent:]
+        if state[0]:
+            return True
+        self._disconnect(client, watch=False)
+        return False
+
+    def _timeout(self, client):
+        logging.debug("Metrics client did not finish its request within %d s" % self.client_timeout)
+        self._clients[client][2] = None
+        self._disconnect(client)
+        return False
+
+    def _disconnect(self, client, watch=True):
+        # watch is False if called from the io watch, which removes itself by returning False
+        _, watch_id, timeout_id = self._clients.pop(client)
+        if watch:
+            GLib.source_remove(watch_id)
+        if timeout_id is not None:
+            GLib.source_remove(timeout_id)
+        client.close()
+
+    def _get_response(self):
+        # render again only if the last response is older than max_age
+        now = monotonic()
+        if self._response is None or now - self._rendered >= self.max_age:
+            body = self.render().encode()
+            self._response = (
+                b"HTTP/1.0 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n"
+                % (self.content_type.encode(), len(body))
+            ) + body
+            self._rendered = now
+        return self._response
+
+    @staticmethod
+    def _rss_bytes():
+        try:
+            with open("/proc/self/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def render(self):
+        host = self._host
+        lines = []
+
+        histogram = host.tick_seconds
+        lines.append("# TYPE dbus_multiplus_emulator_tick_seconds histogram")
+        lines.append("# UNIT dbus_multiplus_emulator_tick_seconds seconds")
+        lines.append("# HELP dbus_multiplus_emulator_tick_seconds Duration of the updates of all devices.")
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append('dbus_multiplus_emulator_tick_seconds_bucket{le="%s"} %d' % (bound, cumulative))
+        lines.append('dbus_multiplus_emulator_tick_seconds_bucket{le="+Inf"} %d' % histogram.count)
+        lines.append("dbus_multiplus_emulator_tick_seconds_count %d" % histogram.count)
+        lines.append("dbus_multiplus_emulator_tick_seconds_sum %.6f" % histogram.sum)
+
+        lines.append("# TYPE dbus_multiplus_emulator_input_changes counter")
+        lines.append("# HELP dbus_multiplus_emulator_input_changes Changes received from the grid and battery services.")
+        for service, count in sorted(host.input_changes.items()):
+            lines.append('dbus_multiplus_emulator_input_changes_total{service="%s"} %d' % (service, count))
+
+        if host._dbusmonitor is not None:
+            lines.append("# TYPE dbus_multiplus_emulator_signals_received counter")
+            lines.append("# HELP dbus_multiplus_emulator_signals_received Change signals delivered to the DbusMonitor.")
+            lines.append("dbus_multiplus_emulator_signals_received_total %d" % host._dbusmonitor.signalsReceived)
+
+        lines.append("# TYPE dbus_multiplus_emulator_signals counter")
+        lines.append("# HELP dbus_multiplus_emulator_signals ItemsChanged signals sent by the emulated devices.")
+        for labels, unit in self._units:
+            lines.append("dbus_multiplus_emulator_signals_total{%s} %d" % (labels, unit.signals_sent))
+
+        lines.append("# TYPE dbus_multiplus_emulator_energy_kilowatt_hours counter")
+        lines.append("# UNIT dbus_multiplus_emulator_energy_kilowatt_hours kilowatt_hours")
+        lines.append("# HELP dbus_multiplus_emulator_energy_kilowatt_hours Energy counters of the emulated devices.")
+        for labels, unit in self._units:
+            for direction, kwh in unit.energy_data().items():
+                lines.append(
+                    'dbus_multiplus_emulator_energy_kilowatt_hours_total{%s,direction="%s"} %.3f'
+                    % (labels, direction, kwh)
+                )
 
-def main():
-    _thread.daemon = True  # allow the program to quit
+        rss = self._rss_bytes()
+        if rss is not None:
+            lines.append("# TYPE process_resident_memory_bytes gauge")
+            lines.append("# UNIT process_resident_memory_bytes bytes")
+            lines.append("# HELP process_resident_memory_bytes Resident memory size of the driver.")
+            lines.append("process_resident_memory_bytes %d" % rss)
 
-    from dbus.mainloop.glib import DBusGMainLoop
+        lines.append("# EOF\n")
+        return "\n".join(lines)
 
-    # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
-    DBusGMainLoop(set_as_default=True)
 
+class ConfigWatcher:
+    """Watches the config file with inotify and applies changed values to the running host."""
+
+    # wait for further changes, since editors write a file in several steps
+    delay = 500
+
+    def __init__(self, file, values, host):
+        self.file = file
+        self.values = values
+        self._host = host
+        self._reload_id = None
+        self._monitor = Gio.File.new_for_path(file).monitor_file(Gio.FileMonitorFlags.NONE, None)
+        self._monitor.connect("changed", self._changed)
+
+    def _changed(self, monitor, file, other_file, event):
+        if event not in (
+            Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+            Gio.FileMonitorEvent.CREATED,
+            Gio.FileMonitorEvent.DELETED,
+        ):
+            return
+        if self._reload_id is not None:
+            GLib.source_remove(self._reload_id)
+        self._reload_id = GLib.timeout_add(self.delay, self._reload)
+
+    def _reload(self):
+        self._reload_id = None
+        try:
+            values = read_config(self.file)
+        except Exception as e:
+            logging.error("Error reading %s, keeping the current configuration: %s" % (self.file, str(e)))
+            return False
+
+        old, self.values = self.values, values
+        apply_config(values)
+        self._host.reconfigure(old, values)
+        return False
+
+
+def read_trace(file):
+    # yields (timestamp, service, path, value) from JSON lines or from a CSV file with a
+    # time,service,path,value header
+    with open(file, "r", newline="") as f:
+        if file.endswith(".csv"):
+            for row in csv.DictReader(f):
+                value = row["value"]
+                if value == "":
+                    value = None
+                else:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass
+                yield float(row["time"]), row["service"], row["path"], value
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    yield record["time"], record["service"], record["path"], record["value"]
+                else:
+                    yield tuple(record)
+
+
+class TraceReplay:
+    """
+    Replays a recorded trace of grid and battery values through the derivations of the emulated
+    devices without D-Bus and as fast as possible. Every interval seconds of trace time the
+    changed vebus values of each device are written as one JSON line to the output file.
+    """
+
+    def __init__(self, units, interval=1.0):
+        self.interval = interval
+        # the values of several services are combined like by the devices
+        self.gridValues, grid_handlers = create_aggregated_input_values("grid")
+        self.batteryValues, battery_handlers = create_aggregated_input_values("battery")
+        self._handlers = {"grid": grid_handlers, "battery": battery_handlers}
+        self.units = [(unit["servicename"], VebusValues(unit.get("phases", phases))) for unit in units]
+        # last written values of each device, to only write changes
+        self._written = [[notwritten] * len(derived.values) for servicename, derived in self.units]
+
+    def _sample_energy(self, timestamp):
+        # the battery is shared, so each device gets an equal part of its power
+        battery_power = (self.batteryValues["/Dc/0/Power"].value or 0) / len(self.units)
+        for servicename, derived in self.units:
+            derived.sample_energy(self.gridValues, battery_power, timestamp)
+
+    def _tick(self, timestamp, output):
+        # sample also when the power does not change, like the update of the devices
+        self._sample_energy(timestamp)
+        for (servicename, derived), written in zip(self.units, self._written):
+            derived.compute(self.gridValues, self.batteryValues)
+            values = derived.values
+            changes = {}
+            for path, slot in derived.plan:
+                if written[slot] != values[slot]:
+                    changes[path] = values[slot]
+            written[:] = values
+            if changes:
+                output.write(json.dumps({"time": timestamp, "service": servicename, "values": changes}) + "\n")
+
+    def run(self, trace_file, output_file):
+        records = 0
+        ticks = 0
+        first_tick = None
+        next_tick = None
+        timestamp = None
+        start = monotonic()
+
+        with open(output_file, "w") as output:
+            for timestamp, service, path, value in read_trace(trace_file):
+                if first_tick is None:
+                    first_tick = next_tick = timestamp
+                while timestamp >= next_tick:
+                    self._tick(next_tick, output)
+                    ticks += 1
+                    next_tick = first_tick + ticks * self.interval
+
+                kind = get_input_kind(service)
+                if kind is not None:
+                    for handler in self._handlers[kind].get(path, ()):
+                        handler(service, value)
+                    if path in input_sample_paths[kind]:
+                        self._sample_energy(timestamp)
+                records += 1
+
+            if timestamp is not None:
+                self._tick(timestamp, output)
+                ticks += 1
+
+        logging.info(
+            "Replayed %d records in %d updates in %.2f s, written to %s"
+            % (records, ticks, monotonic() - start, output_file)
+        )
+
+
+def get_paths_dbus():
     # formatting
     def _kwh(p, v):
         return str("%.2f" % v) + "kWh"
@@ -564,7 +2118,7 @@ def main():
     def _s(p, v):
         return str("%s" % v)
 
-    paths_dbus = {
+    return {
         "/Ac/ActiveIn/ActiveInput": {"initial": 0, "textformat": _n},
         "/Ac/ActiveIn/Connected": {"initial": 1, "textformat": _n},
         "/Ac/ActiveIn/CurrentLimit": {"initial": 16, "textformat": _a},
@@ -598,7 +2152,7 @@ def main():
         "/Ac/In/2/CurrentLimitIsAdjustable": {"initial": None, "textformat": _n},
         # ----
         "/Ac/NumberOfAcInputs": {"initial": 1, "textformat": _n},
-        "/Ac/NumberOfPhases": {"initial": 1, "textformat": _n},
+        "/Ac/NumberOfPhases": {"initial": 3, "textformat": _n},
         # ----
         "/Ac/Out/L1/F": {"initial": None, "textformat": _hz},
         "/Ac/Out/L1/I": {"initial": None, "textformat": _a},
@@ -769,16 +2323,16 @@ def main():
         "/Devices/Dmc/Version": {"initial": None, "textformat": _s},
         "/Devices/NumberOfMultis": {"initial": 1, "textformat": _n},
         # ----
-        "/Energy/AcIn1ToAcOut": {"initial": 0, "textformat": _n},
-        "/Energy/AcIn1ToInverter": {"initial": 0, "textformat": _n},
-        "/Energy/AcIn2ToAcOut": {"initial": 0, "textformat": _n},
-        "/Energy/AcIn2ToInverter": {"initial": 0, "textformat": _n},
-        "/Energy/AcOutToAcIn1": {"initial": 0, "textformat": _n},
-        "/Energy/AcOutToAcIn2": {"initial": 0, "textformat": _n},
-        "/Energy/InverterToAcIn1": {"initial": 0, "textformat": _n},
-        "/Energy/InverterToAcIn2": {"initial": 0, "textformat": _n},
-        "/Energy/InverterToAcOut": {"initial": 0, "textformat": _n},
-        "/Energy/OutToInverter": {"initial": 0, "textformat": _n},
+        "/Energy/AcIn1ToAcOut": {"initial": 0, "textformat": _kwh},
+        "/Energy/AcIn1ToInverter": {"initial": 0, "textformat": _kwh},
+        "/Energy/AcIn2ToAcOut": {"initial": 0, "textformat": _kwh},
+        "/Energy/AcIn2ToInverter": {"initial": 0, "textformat": _kwh},
+        "/Energy/AcOutToAcIn1": {"initial": 0, "textformat": _kwh},
+        "/Energy/AcOutToAcIn2": {"initial": 0, "textformat": _kwh},
+        "/Energy/InverterToAcIn1": {"initial": 0, "textformat": _kwh},
+        "/Energy/InverterToAcIn2": {"initial": 0, "textformat": _kwh},
+        "/Energy/InverterToAcOut": {"initial": 0, "textformat": _kwh},
+        "/Energy/OutToInverter": {"initial": 0, "textformat": _kwh},
         "/ExtraBatteryCurrent": {"initial": 0, "textformat": _n},
         # ----
         "/FirmwareFeatures/BolFrame": {"initial": 1, "textformat": _n},
@@ -820,7 +2374,7 @@ def main():
         "/Leds/Temperature": {"initial": 0, "textformat": _n},
         "/Mode": {"initial": 3, "textformat": _n},
         "/ModeIsAdjustable": {"initial": 1, "textformat": _n},
-        "/PvInverter/Disable": {"initial": 1, "textformat": _n},
+        "/PvInverter/Disable": {"initial": 0, "textformat": _n},
         "/Quirks": {"initial": 0, "textformat": _n},
         "/RedetectSystem": {"initial": 0, "textformat": _n},
         "/Settings/Alarm/System/GridLost": {"initial": 1, "textformat": _n},
@@ -828,7 +2382,7 @@ def main():
         "/Settings/SystemSetup/AcInput2": {"initial": 0, "textformat": _n},
         "/ShortIds": {"initial": 1, "textformat": _n},
         "/Soc": {"initial": None, "textformat": _percent},
-        "/State": {"initial": 3, "textformat": _n},
+        "/State": {"initial": 8, "textformat": _n},
         "/SystemReset": {"initial": None, "textformat": _n},
         "/VebusChargeState": {"initial": 1, "textformat": _n},
         "/VebusError": {"initial": 0, "textformat": _n},
@@ -837,16 +2391,82 @@ def main():
         "/UpdateIndex": {"initial": 0, "textformat": _n},
     }
 
-    DbusMultiPlusEmulator(
-        servicename="com.victronenergy.vebus.ttyS3",
-        deviceinstance=275,
-        paths=paths_dbus,
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulates a MultiPlus II on D-Bus")
+    parser.add_argument(
+        "--replay",
+        metavar="TRACE",
+        help="replay a recorded trace of grid and battery values (JSON lines or CSV) without D-Bus",
     )
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        default="replay.jsonl",
+        help="file to write the vebus values of the replay to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds of trace time between two updates of the replay (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        nargs="?",
+        const=record_file,
+        help="append the received grid and battery changes to FILE for --replay (default: %s)"
+        % record_file,
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="log the time spent in each phase of the startup",
+    )
+    args = parser.parse_args()
+    startup_profile.enabled = args.profile_startup
+    startup_profile.mark("imports")
+
+    if os.path.exists(config_file):
+        logging.info("Reading configuration from %s" % config_file)
+    config = read_config(config_file)
+    apply_config(config)
+    startup_profile.mark("configuration read")
+
+    if args.replay:
+        TraceReplay(units, args.interval).run(args.replay, args.output)
+        return
+
+    _thread.daemon = True  # allow the program to quit
+
+    from dbus.mainloop.glib import DBusGMainLoop
+
+    # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
+    DBusGMainLoop(set_as_default=True)
+
+    recorder = TraceRecorder(args.record) if args.record else None
+    host = EmulatorHost(units, get_paths_dbus(), recorder)
+    metrics = MetricsExporter(host, metrics_address) if metrics_address else None
+    # keep a reference, the file monitor stops when it is garbage collected
+    config_watcher = ConfigWatcher(config_file, config, host)  # noqa: F841
 
     logging.info(
         "Connected to dbus and switching over to GLib.MainLoop() (= event based)"
     )
     mainloop = GLib.MainLoop()
+
+    def _shutdown():
+        logging.info("Received signal, saving energy counters and exiting")
+        host.shutdown()
+        if metrics is not None:
+            metrics.close()
+        mainloop.quit()
+        return False
+
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        GLib.unix_signal_add(GLib.PRIORITY_HIGH, signum, _shutdown)
+
     mainloop.run()
 
 
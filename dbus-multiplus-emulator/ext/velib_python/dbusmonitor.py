@@ -25,7 +25,7 @@ import argparse
 import pprint
 import traceback
 import os
-from collections import defaultdict
+from collections import defaultdict, deque
 from functools import partial
 
 # our own packages
@@ -42,55 +42,185 @@ class SessionBus(dbus.bus.BusConnection):
 	def __new__(cls):
 		return dbus.bus.BusConnection.__new__(cls, dbus.bus.BusConnection.TYPE_SESSION)
 
+## Slots instead of a __dict__, as there is one per monitored path of every service. seen is set
+# when the path was found on the service, see Service.set_seen. bound are the BoundValues that
+# currently read this value, None if there are none.
 class MonitoredValue(object):
+	__slots__ = ('value', '_text', 'options', 'seen', 'bound')
+
 	def __init__(self, value, text, options):
 		super(MonitoredValue, self).__init__()
 		self.value = value
 		self.text = text
 		self.options = options
+		self.seen = False
+		self.bound = None
+
+	## Services that do not send a text get notfound as text, the text is then only built from the
+	# value when it is asked for.
+	@property
+	def text(self):
+		if self._text is notfound:
+			return str(self.value)
+		return self._text
+
+	@text.setter
+	def text(self, text):
+		self._text = text
 
 	# For legacy code, allow treating this as a tuple/list
 	def __iter__(self):
 		return iter((self.value, self.text, self.options))
 
+## A value bound with DbusMonitor.bind_value to a service name or a service class and a path.
+# The monitor keeps value up to date, so reading it is a single attribute load. It stays valid when
+# the service disappears and comes back, in between value is the default value. serviceName is the
+# service the value is read from, None if there is none.
+class BoundValue(object):
+	__slots__ = ('value', 'service', 'path', 'default', 'serviceName', 'monitored')
+
+	def __init__(self, service, path, default):
+		self.value = default
+		self.service = service
+		self.path = path
+		self.default = default
+		self.serviceName = None
+		self.monitored = None
+
+	def _bind(self, service):
+		monitored = None if service is None else service.paths.get(self.path)
+		if monitored is self.monitored:
+			return
+
+		if self.monitored is not None:
+			bound = tuple(b for b in self.monitored.bound if b is not self)
+			self.monitored.bound = bound or None
+
+		self.monitored = monitored
+		if monitored is None:
+			self.serviceName = None
+			self.value = self.default
+		else:
+			monitored.bound = (monitored.bound or ()) + (self,)
+			self.serviceName = service.name
+			self.value = self.default if monitored.value is None else monitored.value
+
+## The changes passed to the valueChangedCallback. A missing Text is only built from the Value when
+# it is asked for, as most receivers only need the value.
+class ValueChanges(dict):
+	def __missing__(self, key):
+		if key != 'Text':
+			raise KeyError(key)
+		self['Text'] = text = str(self['Value'])
+		return text
+
+	def get(self, key, default=None):
+		if key == 'Text':
+			return self['Text']
+		return dict.get(self, key, default)
+
 class Service(object):
+	__slots__ = ('id', 'name', 'paths', 'deviceInstance')
+
 	def __init__(self, id, serviceName, deviceInstance):
 		super(Service, self).__init__()
 		self.id = id
 		self.name = serviceName
 		self.paths = {}
-		self._seen = set()
 		self.deviceInstance = deviceInstance
 
 	# For legacy code, attributes can still be accessed as if keys from a
 	# dictionary.
 	def __setitem__(self, key, value):
-		self.__dict__[key] = value
+		setattr(self, key, value)
 	def __getitem__(self, key):
-		return self.__dict__[key]
+		try:
+			return getattr(self, key)
+		except AttributeError:
+			raise KeyError(key)
 
+	## The seen flag is kept on the MonitoredValue of the path, so the path has to be added first
 	def set_seen(self, path):
-		self._seen.add(path)
+		self.paths[path].seen = True
 
 	def seen(self, path):
-		return path in self._seen
+		try:
+			return self.paths[path].seen
+		except KeyError:
+			return False
 
 	@property
 	def service_class(self):
 		return '.'.join(self.name.split('.')[:3])
 
+## Collects the replies of the asynchronous scan of one service, see DbusMonitor.scan_dbus_service_async
+class ServiceScan(object):
+	def __init__(self, serviceName, paths, callback):
+		self.name = serviceName
+		self.paths = paths
+		self.callback = callback
+		self.serviceId = None
+		self.deviceInstance = None
+		# bulk and individual replies, indexed by path without the leading slash like a bulk reply
+		self.values = {}
+		self.texts = {}
+		self.seen = set()
+		self.pending = 0
+		self.bulkPending = 2
+		self.failed = False
+		self.cancelled = False
+		self.finished = False
+
 class DbusMonitor(object):
 	## Constructor
+	# With asyncScan the services are scanned with asynchronous calls, at most maxPendingScanCalls
+	# at once, and the constructor returns before the scan is done. scanFinishedCallback is called
+	# without arguments once all services found on startup are scanned.
+	# With scopedSignals the change signals are only subscribed for the services in the dbusTree,
+	# with match rules on their name, instead of for all services on the bus. scopedSignalPaths
+	# additionally limits PropertiesChanged to the monitored paths, with one match rule per path.
 	def __init__(self, dbusTree, valueChangedCallback=None, deviceAddedCallback=None,
-					deviceRemovedCallback=None, namespace="com.victronenergy"):
+					deviceRemovedCallback=None, namespace="com.victronenergy",
+					asyncScan=False, maxPendingScanCalls=16, scanFinishedCallback=None,
+					scopedSignals=False, scopedSignalPaths=False, valuesChangedCallback=None):
 		# valueChangedCallback is the callback that we call when something has changed.
 		# def value_changed_on_dbus(dbusServiceName, dbusPath, options, changes, deviceInstance):
 		# in which changes is a tuple with GetText() and GetValue()
 		self.valueChangedCallback = valueChangedCallback
+		# valuesChangedCallback gets all changes since the last main loop iteration in one call,
+		# instead of one valueChangedCallback per change:
+		# def values_changed_on_dbus(changes):
+		# in which changes is a list of (dbusServiceName, dbusPath, options, changes, deviceInstance)
+		self.valuesChangedCallback = valuesChangedCallback
 		self.deviceAddedCallback = deviceAddedCallback
 		self.deviceRemovedCallback = deviceRemovedCallback
 		self.dbusTree = dbusTree
 
+		# Asynchronous scan: calls waiting for a free slot, number of calls in flight and
+		# the scans in progress by service name
+		self.asyncScan = asyncScan
+		self.maxPendingScanCalls = maxPendingScanCalls
+		self._scanQueue = deque()
+		self._scanCallsInFlight = 0
+		self._scans = {}
+		self._scansById = {}
+
+		# Match rules of the change signals per service name, when scoped
+		self.scopedSignals = scopedSignals
+		self.scopedSignalPaths = scopedSignalPaths
+		self.serviceMatches = {}
+
+		# Number of change signals received, to see the effect of scopedSignals
+		self.signalsReceived = 0
+
+		# BoundValues by (service name or class, path)
+		self.boundValues = {}
+
+		# Changes waiting for the callbacks by (service name, path), only the latest one is kept.
+		# They are delivered together by a single idle source.
+		self._pendingChanges = {}
+		self._pendingChangesId = None
+
 		# Lists all tracked services. Stores name, id, device instance, value per path, and whenToLog info
 		# indexed by service name (eg. com.victronenergy.settings).
 		self.servicesByName = {}
@@ -115,24 +245,31 @@ class DbusMonitor(object):
 
 		self.add_name_owner_changed_receiver(standardBus, self.dbus_name_owner_changed)
 
-		# Subscribe to PropertiesChanged for all services
-		self.dbusConn.add_signal_receiver(self.handler_value_changes,
-			dbus_interface='com.victronenergy.BusItem',
-			signal_name='PropertiesChanged', path_keyword='path',
-			sender_keyword='senderId')
+		if not scopedSignals:
+			# Subscribe to PropertiesChanged for all services
+			self.dbusConn.add_signal_receiver(self.handler_value_changes,
+				dbus_interface='com.victronenergy.BusItem',
+				signal_name='PropertiesChanged', path_keyword='path',
+				sender_keyword='senderId')
 
-		# Subscribe to ItemsChanged for all services
-		self.dbusConn.add_signal_receiver(self.handler_item_changes,
-			dbus_interface='com.victronenergy.BusItem',
-			signal_name='ItemsChanged', path='/',
-			sender_keyword='senderId')
+			# Subscribe to ItemsChanged for all services
+			self.dbusConn.add_signal_receiver(self.handler_item_changes,
+				dbus_interface='com.victronenergy.BusItem',
+				signal_name='ItemsChanged', path='/',
+				sender_keyword='senderId')
 
 		logger.info('===== Search on dbus for services that we will monitor starting... =====')
 		serviceNames = self.dbusConn.list_names()
+		if asyncScan:
+			self._scan_startup_async(serviceNames, scanFinishedCallback)
+			return
+
 		for serviceName in serviceNames:
 			self.scan_dbus_service(serviceName)
 
 		logger.info('===== Search on dbus for services that we will monitor finished =====')
+		if scanFinishedCallback is not None:
+			GLib.idle_add(exit_on_error, scanFinishedCallback)
 
 	@staticmethod
 	def make_service(serviceId, serviceName, deviceInstance):
@@ -168,10 +305,18 @@ class DbusMonitor(object):
 	def _process_name_owner_changed(self, name, oldowner, newowner):
 		if newowner != '':
 			# so we found some new service. Check if we can do something with it.
+			if self.asyncScan:
+				self.scan_dbus_service_async(name, self._service_scanned)
+				return
 			newdeviceadded = self.scan_dbus_service(name)
 			if newdeviceadded and self.deviceAddedCallback is not None:
 				self.deviceAddedCallback(name, self.get_device_instance(name))
 
+		elif name in self._scans:
+			# it disappeared while being scanned, drop the replies
+			self._scans.pop(name).cancelled = True
+			self._remove_service_matches(name)
+
 		elif name in self.servicesByName:
 			# it disappeared, we need to remove it.
 			logger.info("%s disappeared from the dbus. Removing it from our lists" % name)
@@ -181,17 +326,52 @@ class DbusMonitor(object):
 			for watch in self.serviceWatches[name]:
 				watch.remove()
 			del self.serviceWatches[name]
+			self._remove_service_matches(name)
 			self.servicesByClass[service.service_class].remove(service)
+			self._rebind_values(service)
 			if self.deviceRemovedCallback is not None:
 				self.deviceRemovedCallback(name, service.deviceInstance)
 
+	## Subscribes to the change signals of a service, when scoped. Done before the service is scanned,
+	# so no change between the scan and the subscription is missed.
+	def _add_service_matches(self, serviceName, paths):
+		if not self.scopedSignals or serviceName in self.serviceMatches:
+			return
+
+		matches = [self.dbusConn.add_signal_receiver(self.handler_item_changes,
+			dbus_interface='com.victronenergy.BusItem',
+			signal_name='ItemsChanged', path='/', bus_name=serviceName,
+			sender_keyword='senderId')]
+
+		if self.scopedSignalPaths:
+			for path in paths:
+				matches.append(self.dbusConn.add_signal_receiver(self.handler_value_changes,
+					dbus_interface='com.victronenergy.BusItem',
+					signal_name='PropertiesChanged', path=path, bus_name=serviceName,
+					path_keyword='path', sender_keyword='senderId'))
+		else:
+			matches.append(self.dbusConn.add_signal_receiver(self.handler_value_changes,
+				dbus_interface='com.victronenergy.BusItem',
+				signal_name='PropertiesChanged', bus_name=serviceName,
+				path_keyword='path', sender_keyword='senderId'))
+
+		self.serviceMatches[serviceName] = matches
+
+	def _remove_service_matches(self, serviceName):
+		for match in self.serviceMatches.pop(serviceName, ()):
+			match.remove()
+
 	def scan_dbus_service(self, serviceName):
 		try:
-			return self.scan_dbus_service_inner(serviceName)
+			added = self.scan_dbus_service_inner(serviceName)
 		except:
 			logger.error("Ignoring %s because of error while scanning:" % (serviceName))
 			traceback.print_exc()
-			return False
+			added = False
+
+		if not added and str(serviceName) not in self.servicesByName:
+			self._remove_service_matches(str(serviceName))
+		return added
 
 			# Errors 'org.freedesktop.DBus.Error.ServiceUnknown' and
 			# 'org.freedesktop.DBus.Error.Disconnected' seem to happen when the service
@@ -211,6 +391,7 @@ class DbusMonitor(object):
 			return False
 
 		logger.info("Found: %s, scanning and storing items" % serviceName)
+		self._add_service_matches(serviceName, paths)
 		serviceId = self.dbusConn.get_name_owner(serviceName)
 
 		# we should never be notified to add a D-Bus service that we already have. If this assertion
@@ -251,13 +432,12 @@ class DbusMonitor(object):
 			# Try to obtain the value we want from our bulk fetch. If we
 			# cannot find it there, do an individual query.
 			value = values.get(path[1:], notfound)
-			if value != notfound:
-				service.set_seen(path)
+			seen = value is not notfound
 			text = texts.get(path[1:], notfound)
 			if value is notfound or text is notfound:
 				try:
 					value = self.dbusConn.call_blocking(serviceName, path, None, 'GetValue', '', [])
-					service.set_seen(path)
+					seen = True
 					text = self.dbusConn.call_blocking(serviceName, path, None, 'GetText', '', [])
 				except dbus.exceptions.DBusException as e:
 					if e.get_dbus_name() in (
@@ -272,6 +452,8 @@ class DbusMonitor(object):
 					text = None
 
 			service.paths[path] = self.make_monitor(service, path, unwrap_dbus_value(value), unwrap_dbus_value(text), options)
+			if seen:
+				service.set_seen(path)
 
 
 		logger.debug("Finished scanning and storing items for %s" % serviceName)
@@ -281,10 +463,196 @@ class DbusMonitor(object):
 		self.servicesByName[serviceName] = service
 		self.servicesById[serviceId] = service
 		self.servicesByClass[service.service_class].append(service)
+		self._rebind_values(service)
+
+		return True
+
+	def _service_scanned(self, serviceName, added):
+		if added and self.deviceAddedCallback is not None:
+			self.deviceAddedCallback(serviceName, self.get_device_instance(serviceName))
 
+	def _scan_startup_async(self, serviceNames, callback):
+		# scans all services at once, the time needed depends on the slowest service instead of
+		# on the sum of all services
+		remaining = [0]
+
+		def scanned(serviceName, added):
+			remaining[0] -= 1
+			if remaining[0] == 0:
+				logger.info('===== Search on dbus for services that we will monitor finished =====')
+				if callback is not None:
+					callback()
+
+		for serviceName in serviceNames:
+			if self.scan_dbus_service_async(serviceName, scanned):
+				remaining[0] += 1
+
+		if remaining[0] == 0:
+			# nothing to scan, call back from the main loop like after a scan
+			remaining[0] = 1
+			GLib.idle_add(exit_on_error, scanned, None, False)
+
+	## Scans the given service like scan_dbus_service, but with asynchronous calls. Returns False if the
+	# service is not in the tree or already scanned. Otherwise callback(serviceName, added) is called
+	# from the main loop when the scan is done, added is False if the service could not be scanned.
+	def scan_dbus_service_async(self, serviceName, callback):
+		serviceName = str(serviceName)
+
+		paths = self.dbusTree.get('.'.join(serviceName.split('.')[0:3]), None)
+		if paths is None:
+			logger.debug("Ignoring service %s, not in the tree" % serviceName)
+			return False
+
+		if serviceName in self.servicesByName or serviceName in self._scans:
+			return False
+
+		logger.info("Found: %s, scanning and storing items" % serviceName)
+		scan = ServiceScan(serviceName, paths, callback)
+		self._scans[serviceName] = scan
+		self._add_service_matches(serviceName, paths)
+
+		# all requests of a service that do not depend on each other are queued at once
+		self._scan_call(scan, '/org/freedesktop/DBus', 'GetNameOwner', self._scan_name_owner,
+			busName='org.freedesktop.DBus', interface='org.freedesktop.DBus', signature='s', args=[serviceName])
+		if serviceName == 'com.victronenergy.settings' or serviceName.startswith('com.victronenergy.vecan.'):
+			scan.deviceInstance = 0
+		else:
+			self._scan_call(scan, '/DeviceInstance', 'GetValue', self._scan_device_instance)
+		self._scan_call(scan, '/', 'GetValue', self._scan_bulk_values)
+		self._scan_call(scan, '/', 'GetText', self._scan_bulk_texts)
 		return True
 
+	def _scan_call(self, scan, path, method, handler, busName=None, interface=None, signature='', args=[]):
+		scan.pending += 1
+		self._scanQueue.append((scan, busName or scan.name, path, interface, method, signature, args, handler))
+		self._scan_next()
+
+	def _scan_next(self):
+		while self._scanQueue and self._scanCallsInFlight < self.maxPendingScanCalls:
+			scan, busName, path, interface, method, signature, args, handler = self._scanQueue.popleft()
+			if scan.failed or scan.cancelled:
+				scan.pending -= 1
+				self._scan_check_finished(scan)
+				continue
+
+			self._scanCallsInFlight += 1
+			self.dbusConn.call_async(busName, path, interface, method, signature, args,
+				reply_handler=partial(self._scan_reply, scan, path, handler),
+				error_handler=partial(self._scan_error, scan, path, handler))
+
+	def _scan_reply(self, scan, path, handler, *result):
+		self._scan_done(scan, path, handler, result[0] if result else None, None)
+
+	def _scan_error(self, scan, path, handler, error):
+		self._scan_done(scan, path, handler, None, error)
+
+	def _scan_done(self, scan, path, handler, value, error):
+		self._scanCallsInFlight -= 1
+		scan.pending -= 1
+		if not scan.failed and not scan.cancelled:
+			if isinstance(error, dbus.exceptions.DBusException) and error.get_dbus_name() in (
+					'org.freedesktop.DBus.Error.ServiceUnknown',
+					'org.freedesktop.DBus.Error.Disconnected',
+					'org.freedesktop.DBus.Error.NameHasNoOwner'):
+				logger.error("Ignoring %s because of error while scanning: %s" % (scan.name, error))
+				scan.failed = True
+			else:
+				try:
+					handler(scan, path, value, error)
+				except Exception:
+					logger.error("Ignoring %s because of error while scanning:" % (scan.name))
+					traceback.print_exc()
+					scan.failed = True
+		self._scan_check_finished(scan)
+		self._scan_next()
+
+	def _scan_name_owner(self, scan, path, value, error):
+		if error is not None:
+			raise error
+		scan.serviceId = str(value)
+		self._scansById[scan.serviceId] = scan
+
+	def _scan_device_instance(self, scan, path, value, error):
+		if error is not None:
+			logger.info("       %s was skipped because it has no device instance" % scan.name)
+			scan.failed = True
+			return
+		scan.deviceInstance = int(value)
+		logger.info("       %s has device instance %s" % (scan.name, scan.deviceInstance))
+
+	def _scan_bulk_values(self, scan, path, value, error):
+		if error is None:
+			scan.values.update(value)
+		self._scan_bulk_done(scan)
+
+	def _scan_bulk_texts(self, scan, path, value, error):
+		if error is None:
+			scan.texts.update(value)
+		self._scan_bulk_done(scan)
+
+	def _scan_bulk_done(self, scan):
+		scan.bulkPending -= 1
+		if scan.bulkPending > 0:
+			return
+
+		# paths missing in the bulk replies are fetched individually
+		for path in scan.paths:
+			if path[1:] in scan.values:
+				scan.seen.add(path)
+			if path[1:] not in scan.values or path[1:] not in scan.texts:
+				self._scan_call(scan, path, 'GetValue', self._scan_path_value)
+				self._scan_call(scan, path, 'GetText', self._scan_path_text)
+
+	def _scan_path_value(self, scan, path, value, error):
+		if error is not None:
+			logger.debug("%s %s does not exist (yet)" % (scan.name, path))
+			value = None
+		else:
+			scan.seen.add(path)
+		scan.values[path[1:]] = value
+
+	def _scan_path_text(self, scan, path, value, error):
+		scan.texts[path[1:]] = None if error is not None else value
+
+	def _scan_check_finished(self, scan):
+		if scan.pending > 0 or scan.finished:
+			return
+		scan.finished = True
+
+		added = False
+		if self._scansById.get(scan.serviceId) is scan:
+			del self._scansById[scan.serviceId]
+		if self._scans.get(scan.name) is scan:
+			del self._scans[scan.name]
+			if not scan.failed and scan.serviceId not in self.servicesById:
+				service = self.make_service(scan.serviceId, scan.name, scan.deviceInstance)
+				for path, options in scan.paths.items():
+					value = scan.values.get(path[1:], None)
+					text = scan.texts.get(path[1:], None)
+					service.paths[path] = self.make_monitor(service, path, unwrap_dbus_value(value), unwrap_dbus_value(text), options)
+					if path in scan.seen:
+						service.set_seen(path)
+
+				logger.debug("Finished scanning and storing items for %s" % scan.name)
+				self.servicesByName[scan.name] = service
+				self.servicesById[scan.serviceId] = service
+				self.servicesByClass[service.service_class].append(service)
+				self._rebind_values(service)
+				added = True
+			else:
+				self._remove_service_matches(scan.name)
+
+		scan.callback(scan.name, added)
+
+	def _scan_changes(self, scan, path, value, text):
+		# a change received during the scan is newer than the replies received before it
+		if path in scan.paths:
+			scan.values[path[1:]] = value
+			scan.texts[path[1:]] = text
+			scan.seen.add(path)
+
 	def handler_item_changes(self, items, senderId):
+		self.signalsReceived += 1
 		if not isinstance(items, dict):
 			return
 
@@ -292,21 +660,29 @@ class DbusMonitor(object):
 			service = self.servicesById[senderId]
 		except KeyError:
 			# senderId isn't there, which means it hasn't been scanned yet.
+			scan = self._scansById.get(senderId)
+			if scan is not None:
+				for path, changes in items.items():
+					if 'Value' in changes:
+						self._scan_changes(scan, path, changes['Value'], changes.get('Text'))
 			return
 
+		# Batches often contain many paths that are not monitored, so check the path before
+		# unwrapping the value. The text is only built when a receiver asks for it.
+		paths = service.paths
 		for path, changes in items.items():
+			if path not in paths:
+				continue
+
 			try:
 				v = unwrap_dbus_value(changes['Value'])
 			except (KeyError, TypeError):
 				continue
 
-			try:
-				t = changes['Text']
-			except KeyError:
-				t = str(v)
-			self._handler_value_changes(service, path, v, t)
+			self._handler_value_changes(service, path, v, changes.get('Text', notfound))
 
 	def handler_value_changes(self, changes, path, senderId):
+		self.signalsReceived += 1
 		# If this properyChange does not involve a value, our work is done.
 		if 'Value' not in changes:
 			return
@@ -315,15 +691,19 @@ class DbusMonitor(object):
 			service = self.servicesById[senderId]
 		except KeyError:
 			# senderId isn't there, which means it hasn't been scanned yet.
+			scan = self._scansById.get(senderId)
+			if scan is not None:
+				self._scan_changes(scan, path, changes['Value'], changes.get('Text'))
+			return
+
+		if path not in service.paths:
+			# path isn't there, which means it hasn't been scanned yet.
 			return
 
 		v = unwrap_dbus_value(changes['Value'])
-		# Some services don't send Text with their PropertiesChanged events.
-		try:
-			t = changes['Text']
-		except KeyError:
-			t = str(v)
-		self._handler_value_changes(service, path, v, t)
+		# Some services don't send Text with their PropertiesChanged events, the text is then
+		# only built when a receiver asks for it.
+		self._handler_value_changes(service, path, v, changes.get('Text', notfound))
 
 	def _handler_value_changes(self, service, path, value, text):
 		try:
@@ -332,7 +712,7 @@ class DbusMonitor(object):
 			# path isn't there, which means it hasn't been scanned yet.
 			return
 
-		service.set_seen(path)
+		a.seen = True
 
 		# First update our store to the new value
 		if a.value == value:
@@ -340,20 +720,41 @@ class DbusMonitor(object):
 
 		a.value = value
 		a.text = text
+		if a.bound is not None:
+			for bound in a.bound:
+				bound.value = bound.default if value is None else value
 
 		# And do the rest of the processing in on the mainloop
-		if self.valueChangedCallback is not None:
-			GLib.idle_add(exit_on_error, self._execute_value_changes, service.name, path, {
-				'Value': value, 'Text': text}, a.options)
-
-	def _execute_value_changes(self, serviceName, objectPath, changes, options):
-		# double check that the service still exists, as it might have
-		# disappeared between scheduling-for and executing this function.
-		if serviceName not in self.servicesByName:
-			return
+		if self.valueChangedCallback is not None or self.valuesChangedCallback is not None:
+			changes = ValueChanges(Value=value)
+			if text is not notfound:
+				changes['Text'] = text
+			self._pendingChanges[(service.name, path)] = (changes, a.options)
+			if self._pendingChangesId is None:
+				self._pendingChangesId = GLib.idle_add(exit_on_error, self._execute_value_changes)
+
+	def _execute_value_changes(self):
+		self._pendingChangesId = None
+		pending, self._pendingChanges = self._pendingChanges, {}
+
+		batch = []
+		for (serviceName, objectPath), (changes, options) in pending.items():
+			# double check that the service still exists, as it might have
+			# disappeared between scheduling-for and executing this function.
+			service = self.servicesByName.get(serviceName)
+			if service is None:
+				continue
 
-		self.valueChangedCallback(serviceName, objectPath,
-			options, changes, self.get_device_instance(serviceName))
+			if self.valuesChangedCallback is not None:
+				batch.append((serviceName, objectPath, options, changes, service.deviceInstance))
+			else:
+				self.valueChangedCallback(serviceName, objectPath,
+					options, changes, service.deviceInstance)
+
+		if batch:
+			self.valuesChangedCallback(batch)
+
+		return False
 
 	# Gets the value for a certain servicename and path
 	# The default_value is returned when:
@@ -372,6 +773,32 @@ class DbusMonitor(object):
 
 		return value.value
 
+	## Returns a BoundValue for a service name or a service class, like com.victronenergy.battery, and
+	# a path. Its value attribute always holds the current value, so consumers that read the same values
+	# over and over do not need to look them up with get_value. For a service class it is read from the
+	# first service of the class that was found. The path has to be in the dbusTree.
+	def bind_value(self, service, objectPath, default_value=None):
+		key = (service, objectPath)
+		bound = self.boundValues.get(key)
+		if bound is None:
+			bound = self.boundValues[key] = BoundValue(service, objectPath, default_value)
+			bound._bind(self._bound_service(service))
+		return bound
+
+	def _bound_service(self, service):
+		try:
+			return self.servicesByName[service]
+		except KeyError:
+			services = self.servicesByClass.get(service)
+			return services[0] if services else None
+
+	## Binds the values of a service name or class to the current service after it was added or removed
+	def _rebind_values(self, service):
+		keys = (service.name, service.service_class)
+		for bound in self.boundValues.values():
+			if bound.service in keys:
+				bound._bind(self._bound_service(bound.service))
+
 	# returns if a dbus exists now, by doing a blocking dbus call.
 	# Typically seen will be sufficient and doesn't need access to the dbus.
 	def exists(self, serviceName, objectPath):
@@ -62,6 +62,9 @@ class VeDbusService(object):
 		# dict containing the VeDbusItemExport objects, with their path as the key.
 		self._dbusobjects = {}
 		self._dbusnodes = {}
+		# number of items and nodes directly below each node except the root, a node is removed
+		# with its last child
+		self._nodechildren = {}
 		self._ratelimiters = []
 		self._dbusname = None
 
@@ -88,6 +91,7 @@ class VeDbusService(object):
 		for node in list(self._dbusnodes.values()):
 			node.__del__()
 		self._dbusnodes.clear()
+		self._nodechildren.clear()
 		for item in list(self._dbusobjects.values()):
 			item.__del__()
 		self._dbusobjects.clear()
@@ -108,11 +112,40 @@ class VeDbusService(object):
 				self._dbusconn, path, value, description, writeable,
 				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype)
 
-		spl = path.split('/')
-		for i in range(2, len(spl)):
-			subPath = '/'.join(spl[:i])
-			if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
-				self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+		# walk up the parent nodes, e.g. /Ac/Out and /Ac for /Ac/Out/P, and create the missing ones.
+		# The first existing one gets one more child. Each node indexes the items below it. A parent
+		# that is an item itself has no node, it only counts its children so the nodes above it are
+		# kept as long as there are paths below it.
+		nodechildren = self._nodechildren
+		counted = False
+		end = path.rfind('/')
+		while end > 0:
+			subPath = path[:end]
+			node = self._dbusnodes.get(subPath)
+			if node is None:
+				count = nodechildren.get(subPath, 0)
+				if subPath in self._dbusobjects:
+					if not counted:
+						nodechildren[subPath] = count + 1
+						counted = count > 0
+					end = path.rfind('/', 0, end)
+					continue
+				node = self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+				if count:
+					# the item at this path was deleted, but the paths below it are still there
+					prefix = subPath[1:] + '/'
+					for itemPath, i in self._dbusnodes['/']._items.items():
+						if itemPath.startswith(prefix):
+							node._items[itemPath[len(prefix):]] = i
+				if not counted:
+					nodechildren[subPath] = count + 1
+					counted = count > 0
+			elif not counted:
+				nodechildren[subPath] += 1
+				counted = True
+			node._items[path[end + 1:]] = item
+			end = path.rfind('/', 0, end)
+		self._dbusnodes['/']._items[path[1:]] = item
 		self._dbusobjects[path] = item
 		logging.debug('added %s with start value %s. Writeable is %s' % (path, value, writeable))
 
@@ -141,14 +174,30 @@ class VeDbusService(object):
 
 	def _item_deleted(self, path):
 		self._dbusobjects.pop(path)
-		for np in list(self._dbusnodes.keys()):
-			if np != '/':
-				for ip in self._dbusobjects:
-					if ip.startswith(np + '/'):
-						break
+		# walk up the parent nodes, remove the item from their index and remove the nodes without
+		# children left. When tearing down in __del__ the nodes and counts are already gone.
+		nodechildren = self._nodechildren
+		removing = True
+		end = path.rfind('/')
+		while end > 0:
+			subPath = path[:end]
+			node = self._dbusnodes.get(subPath)
+			if node is not None:
+				node._items.pop(path[end + 1:], None)
+			if removing and subPath in nodechildren:
+				count = nodechildren[subPath] - 1
+				if count == 0:
+					del nodechildren[subPath]
+					if node is not None:
+						del self._dbusnodes[subPath]
+						node.__del__()
 				else:
-					self._dbusnodes[np].__del__()
-					self._dbusnodes.pop(np)
+					nodechildren[subPath] = count
+					removing = False
+			end = path.rfind('/', 0, end)
+		root = self._dbusnodes.get('/')
+		if root is not None:
+			root._items.pop(path[1:], None)
 
 	def __getitem__(self, path):
 		return self._dbusobjects[path].local_get_value()
@@ -393,6 +442,8 @@ class VeDbusTreeExport(dbus.service.Object):
 	def __init__(self, bus, objectPath, service):
 		dbus.service.Object.__init__(self, bus, objectPath)
 		self._service = service
+		# the items below this node by their path relative to it, kept by VeDbusService
+		self._items = {}
 		logging.debug("VeDbusTreeExport %s has been created" % objectPath)
 
 	def __del__(self):
@@ -411,14 +462,10 @@ class VeDbusTreeExport(dbus.service.Object):
 
 	def _get_value_handler(self, path, get_text=False):
 		logging.debug("_get_value_handler called for %s" % path)
-		r = {}
-		px = path
-		if not px.endswith('/'):
-			px += '/'
-		for p, item in self._service._dbusobjects.items():
-			if p.startswith(px):
-				v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
-				r[p[len(px):]] = v
+		if get_text:
+			r = {p: item.GetText() for p, item in self._items.items()}
+		else:
+			r = {p: item._get_wrapped_value() for p, item in self._items.items()}
 		logging.debug(r)
 		return r
 
@@ -443,7 +490,7 @@ class VeDbusRootExport(VeDbusTreeExport):
 	def GetItems(self):
 		return {
 			path: {
-				'Value': wrap_dbus_value(item.local_get_value()),
+				'Value': item._get_wrapped_value(),
 				'Text': item.GetText() }
 			for path, item in self._service._dbusobjects.items()
 		}
@@ -469,6 +516,8 @@ class VeDbusItemExport(dbus.service.Object):
 		self._onchangecallback = onchangecallback
 		self._gettextcallback = gettextcallback
 		self._value = value
+		# the wrapped value, built on the first query and again on every change
+		self._wrapped = None
 		self._description = description
 		self._writeable = writeable
 		self._deletecallback = deletecallback
@@ -505,14 +554,20 @@ class VeDbusItemExport(dbus.service.Object):
 			return None
 
 		self._value = newvalue
+		self._wrapped = wrapped = wrap_dbus_value(newvalue)
 		return {
-			'Value': wrap_dbus_value(newvalue),
+			'Value': wrapped,
 			'Text': self.GetText()
 		}
 
 	def local_get_value(self):
 		return self._value
 
+	def _get_wrapped_value(self):
+		if self._wrapped is None:
+			self._wrapped = wrap_dbus_value(self._value)
+		return self._wrapped
+
 	# ==== ALL FUNCTIONS BELOW THIS LINE WILL BE CALLED BY OTHER PROCESSES OVER THE DBUS ====
 
 	## Dbus exported method SetValue
@@ -564,7 +619,7 @@ class VeDbusItemExport(dbus.service.Object):
 	# @return the value when valid, and otherwise an empty array
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='v')
 	def GetValue(self):
-		return wrap_dbus_value(self._value)
+		return self._get_wrapped_value()
 
 	## Dbus exported method GetText
 	# Returns the value as string of the dbus-object-path.